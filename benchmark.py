@@ -0,0 +1,739 @@
+'''Measure the speed of the critical parts of the script.
+
+Each benchmark checks that the fast path gives the same results as the 
+original one before reporting the time of both.
+'''
+
+import collections
+import contextlib
+import gzip
+import http.server
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import xml.etree.ElementTree
+import zipfile
+
+import init
+
+
+
+def timer(function, *args):
+	'''Run the function once and return its result and the seconds spent.'''
+
+	start = time.perf_counter()
+	result = function(*args)
+
+	return result, time.perf_counter() - start
+
+
+def report(title, size, old, new):
+	'''Print the time of both versions and the speedup.'''
+
+	print('{} ({} items)'.format(title, size))
+	print('    original: {:.2f}s'.format(old))
+	print('    new:      {:.2f}s ({:.1f}x)'.format(new, old / new))
+
+## -------------------- address analisys --------------------
+
+def addresses(size):
+	'''Generate raw addresses in the forms found in the maillings.
+
+	Args:
+		size: the number of addresses.
+
+	Returns:
+		A list with the same [address, number, complement] lists built 
+		by crawler() from a Parser.
+	'''
+
+	random.seed(0)
+
+	streets = [
+		'Rua dos Andradas',
+		'Av. Ipiranga',
+		'Avenida Protásio Alves',
+		'R. Padre Chagas',
+		'Travessa 2 de Fevereiro',
+		'Rua Sem Número'
+	]
+	complements = ['', 'apto 301', 'Bloco B ap 12', 'casa 2', '  sala 1203']
+
+	column = []
+
+	for i in range(size):
+
+		street = random.choice(streets)
+		number = str(random.randint(1, 99999))
+		complement = random.choice(complements)
+
+		form = i % 3
+
+		# Full address in a single column
+		if form == 0:
+			column.append([street + ', ' + number + ' ' + complement, '', ''])
+		# Separate number and complement columns
+		elif form == 1:
+			column.append([street, ', ' + number, complement])
+		# No number at all
+		else:
+			column.append([street, '', complement])
+
+	return column
+
+
+def splitter(data):
+	'''The original parsing of addressParser(), kept to check the new one.'''
+
+	sequence = [str(x) for x in data]
+
+	pattern = [
+		r'\d{1,4}',
+		r'(\d{1,4})',
+		r'^\s*'
+	]
+
+	string = ' '.join(sequence).replace(',', '')
+
+	address = string if re.search(pattern[0], string) else False
+
+	if address != False:
+		street, complement = re.split(pattern[0], address, maxsplit=1)
+		complement = re.sub(pattern[2], '', complement)
+		complement = False if not complement else complement
+
+		number = re.search(pattern[1], address).groups(0)[0]
+
+		return street, number, complement
+
+	else:
+		return address
+
+
+def parser(size=1000000):
+	'''Compare the original addressParser() with addressParsers().'''
+
+	column = addresses(size)
+
+	old, old_time = timer(lambda x: [splitter(y) for y in x], column)
+	new, new_time = timer(init.addressParsers, column)
+
+	assert old == new, 'addressParsers() differs from the original parsing'
+
+	report('Address parser', size, old_time, new_time)
+
+
+## -------------------- ascii converter --------------------
+
+def names(size):
+	'''Generate a column of repetitive city and street names.'''
+
+	random.seed(0)
+
+	words = [
+		'Porto Alegre',
+		'São Leopoldo',
+		'Rua Protásio Alves',
+		'Avenida Assis Brasil',
+		'Praça da Conceição',
+		'Rua Ramiro Barcelos',
+		'Travessa Açoriana',
+		'Viamão'
+	]
+
+	# A few distinct values, like the numbered streets of a new district
+	return [
+		random.choice(words) + ' ' + str(random.randint(1, 50))
+		for x in range(size)
+	]
+
+
+def accent(size=1000000):
+	'''Compare the original accent() with the new one and accents().'''
+
+	column = names(size)
+	init.accent.cache_clear()
+
+	old, old_time = timer(lambda x: [init.fold(y) for y in x], column)
+	new, new_time = timer(lambda x: [init.accent(y) for y in x], column)
+
+	assert old == new, 'accent() differs from the original folding'
+	report('Accent folding', size, old_time, new_time)
+
+	new, new_time = timer(init.accents, column)
+
+	assert old == new, 'accents() differs from the original folding'
+	report('Accent folding of a column', size, old_time, new_time)
+
+
+## -------------------- Google Maps Geocode API --------------------
+
+def legacy(req):
+	'''The original parsing of google(), kept to check the new one.'''
+
+	functions = [
+		('route', 'long_name'),
+		('number', 'long_name'),
+		('administrative_area_level_2', 'long_name'),
+		('administrative_area_level_1', 'short_name')
+	]
+
+	root = xml.etree.ElementTree.fromstring(req)
+	response = root.find('status').text
+
+	if response != 'OK':
+		return response
+
+	data = []
+
+	for result in root.findall('result'):
+
+		info = []
+
+		for children in result:
+
+			try:
+				type = children.find('type')
+				for pattern, name in functions:
+					if re.search(pattern, type.text):
+						info.append(children.find(name).text)
+
+			except AttributeError:
+
+				try:
+					location = children.find('location')
+					for coordinates in location:
+						info.append(coordinates.text)
+
+				except TypeError:
+					continue
+
+		data.append(info)
+
+	return data, response
+
+
+def component(long, short, *types):
+	'''Return the XML of an address component.'''
+	return ('<address_component><long_name>{}</long_name>'
+		'<short_name>{}</short_name>{}</address_component>').format(
+			long,
+			short,
+			''.join('<type>{}</type>'.format(x) for x in types)
+		)
+
+
+def responses(size):
+	'''Return the stored responses, or generate them if there are none.
+
+	Generated responses have one to three results, some of them without 
+	a street number, like the ones given for streets without numbers.
+	'''
+
+	try:
+		stored = [x[1] for x in init.responses()]
+	except OSError:
+		stored = []
+
+	if stored:
+		return stored[:size]
+
+	random.seed(0)
+	corpus = []
+
+	for i in range(size):
+
+		results = []
+
+		for j in range(random.randint(1, 3)):
+
+			parts = []
+
+			if random.random() > 0.2:
+				number = str(random.randint(1, 9999))
+				parts.append(component(number, number, 'street_number'))
+
+			parts += [
+				component('Avenida Ipiranga', 'Av. Ipiranga', 'route'),
+				component('Azenha', 'Azenha', 'political', 'sublocality'),
+				component('Porto Alegre', 'Porto Alegre',
+					'administrative_area_level_2', 'political'),
+				component('Rio Grande do Sul', 'RS',
+					'administrative_area_level_1', 'political'),
+				component('Brazil', 'BR', 'country', 'political'),
+				component('90160-091', '90160-091', 'postal_code')
+			]
+
+			results.append(
+				'<result><type>street_address</type>'
+				'<formatted_address>Av. Ipiranga</formatted_address>'
+				'{}<geometry><location><lat>-30.05</lat>'
+				'<lng>-51.21</lng></location>'
+				'<location_type>ROOFTOP</location_type></geometry>'
+				'<place_id>{}</place_id></result>'.format(''.join(parts), i)
+			)
+
+		corpus.append(
+			'<?xml version="1.0" encoding="UTF-8"?>'
+			'<GeocodeResponse><status>OK</status>{}'
+			'</GeocodeResponse>'.format(''.join(results))
+		)
+
+	return corpus
+
+
+def geocode(size=100000):
+	'''Compare the original parsing of google() with parse().'''
+
+	corpus = responses(size)
+
+	old, old_time = timer(lambda x: [legacy(y) for y in x], corpus)
+	new, new_time = timer(lambda x: [init.parse(y) for y in x], corpus)
+
+	# The original parsing leaves out the missing street number
+	for x, y in zip(old, new):
+		if type(y) == tuple:
+			y = [[z for z in info if z is not None] for info in y[0]], y[1]
+		assert x == y, 'parse() differs from the original parsing'
+
+	report('Geocode parsing', len(corpus), old_time, new_time)
+
+
+## -------------------- Correios parser --------------------
+
+def soup(req):
+	'''The original parsing of correios(), kept to check the new one.'''
+
+	import bs4
+
+	html = bs4.BeautifulSoup(req, 'html.parser')
+	response = html.find_all('p')[-1].text
+
+	if re.search('NAO', response):
+		return response
+
+	rows = html.find_all('table')[0].find_all('tr')
+
+	return [[x.text for x in row.find_all('td')] for row in rows[1:]]
+
+
+def targeted(req):
+	'''The same as soup(), through init.Page.'''
+
+	html = init.Page(req)
+	response = html.status()
+
+	if re.search('NAO', response):
+		return response
+
+	return html.table()[1:]
+
+
+def pages(size):
+	'''Return the saved result pages, or generate them if there are none.
+
+	Pages saved by hand go in the Logs\\Correios folder. Generated pages 
+	follow the layout of the real ones, with one or more zip codes, 
+	negative answers, entities and the usual broken markup.
+	'''
+
+	directory = init.path + '\\Logs\\Correios'
+
+	try:
+		listing = [x for x in os.listdir(directory) if re.search(r'\.html?$', x)]
+	except OSError:
+		listing = []
+
+	if listing:
+		saved = []
+		for item in listing[:size]:
+			with open(r'{}\{}'.format(directory, item), 'r',
+				encoding='iso-8859-1') as f:
+				saved.append(f.read())
+		return saved
+
+	random.seed(0)
+	corpus = []
+
+	head = ('<html><head><meta charset="iso-8859-1"><title>Busca CEP</title>'
+		'<link rel="stylesheet" href="x.css"></head><body>'
+		'<div class="ctrlcontent"><h3>Busca CEP - Endere&ccedil;o</h3>'
+		'<p>Pesquisa realizada<br>em 12/03/2017</p>')
+	tail = ('<div class="btnform"><a href="#">Nova Consulta</a></div>'
+		'</div><div id="footer"><p>Correios &copy; 2017</p></div>'
+		'</body></html>')
+
+	for i in range(size):
+
+		if random.random() < 0.2:
+			corpus.append(head + tail.replace(
+				'<p>Correios &copy; 2017</p>',
+				'<p>DADOS NAO ENCONTRADOS</p>'
+			))
+			continue
+
+		rows = ''.join(
+			'<tr><td width="150">Rua Jo&atilde;o Alfredo - de {0} a {1}'
+			'&nbsp;</td><td width="90">Cidade Baixa&nbsp;</td>'
+			'<td width="80">Porto Alegre/RS</td>'
+			'<td width="55">{2}</td></tr>'.format(
+				j * 100,
+				j * 100 + 98,
+				'90050-{:03d}'.format(random.randint(0, 999))
+			) for j in range(random.randint(1, 4))
+		)
+
+		body = ('<p>DADOS ENCONTRADOS COM SUCESSO.</p>'
+			'<table class="tmptabela"><tr><th>Logradouro/Nome:</th>'
+			'<th>Bairro/Distrito:</th><th>Localidade/UF:</th>'
+			'<th>CEP:</th></tr>' + rows + '</table>')
+
+		# The footer paragraph holds the status in the real pages
+		corpus.append(head + body + tail.replace(
+			'<p>Correios &copy; 2017</p>',
+			'<p>DADOS ENCONTRADOS COM SUCESSO.</p>'
+		))
+
+	return corpus
+
+
+def correios(size=20000):
+	'''Compare the original parsing of correios() with Page.'''
+
+	corpus = pages(size)
+
+	old, old_time = timer(lambda x: [soup(y) for y in x], corpus)
+	new, new_time = timer(lambda x: [targeted(y) for y in x], corpus)
+
+	for page, x, y in zip(corpus, old, new):
+		assert x == y, 'Page differs from BeautifulSoup:\n' + page
+
+	report('Correios parsing', len(corpus), old_time, new_time)
+
+
+## -------------------- end-to-end run --------------------
+
+class Stub(http.server.BaseHTTPRequestHandler):
+	'''Answer as Google or Correios would, with canned responses.
+
+	The server holds the responses, the seconds each answer takes and 
+	the rate of failed answers. Google fails with an OVER_QUERY_LIMIT 
+	status, as the real API does, and Correios with an error page.
+	'''
+
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		self.answer()
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		self.answer()
+
+	def answer(self):
+		server = self.server
+
+		time.sleep(random.uniform(0.5, 1.5) * server.latency)
+
+		status = 200
+		with server.lock:
+			failed = server.random.random() < server.errors
+			body, packed = server.corpus[server.served % len(server.corpus)]
+			server.served += 1
+
+		if failed and server.failure is None:
+			status, body, packed = 500, b'', None
+		elif failed:
+			body, packed = server.failure, None
+
+		self.send_response(status)
+
+		if 'gzip' in self.headers.get('Accept-Encoding', '') and body:
+			body = packed or gzip.compress(body)
+			self.send_header('Content-Encoding', 'gzip')
+
+		self.send_header('Content-Type', 'text/html; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+def serve(corpus, latency, errors, failure=None):
+	'''Start a stand-in server in a thread and return it with its url.
+
+	Args:
+		corpus: the responses, given in turns.
+		latency: the mean seconds each answer takes.
+		errors: the rate of failed answers, from 0 to 1.
+		failure: the body of a failed answer, or None to fail with an 
+			HTTP error.
+	'''
+
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+	server.daemon_threads = True
+
+	# Compressed once, so the server doesn't slow down the client
+	server.corpus = [
+		(x.encode('utf-8'), gzip.compress(x.encode('utf-8'))) for x in corpus
+	]
+	server.latency = latency
+	server.errors = errors
+	server.failure = failure.encode('utf-8') if failure else None
+	server.random = random.Random(0)
+	server.served = 0
+	server.lock = threading.Lock()
+
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+def workbook(archive, rows):
+	'''Write a xlsx workbook with a single sheet of text cells.
+
+	The file is written by hand, with inline strings, so no package is 
+	needed. Both openpyxl and xlrd read it.
+	'''
+
+	def escape(value):
+		return (str(value).replace('&', '&amp;')
+			.replace('<', '&lt;')
+			.replace('>', '&gt;'))
+
+	sheet = []
+
+	for i, row in enumerate(rows, 1):
+		cells = ''.join(
+			'<c r="{}{}" t="inlineStr"><is><t xml:space="preserve">{}'
+			'</t></is></c>'.format(chr(65 + j), i, escape(x))
+			for j, x in enumerate(row)
+		)
+		sheet.append('<row r="{}">{}</row>'.format(i, cells))
+
+	namespace = 'http://schemas.openxmlformats.org'
+	relationships = namespace + '/officeDocument/2006/relationships'
+
+	files = {
+		'[Content_Types].xml': (
+			'<Types xmlns="{0}/package/2006/content-types">'
+			'<Default Extension="rels" ContentType="application/'
+			'vnd.openxmlformats-package.relationships+xml"/>'
+			'<Default Extension="xml" ContentType="application/xml"/>'
+			'<Override PartName="/xl/workbook.xml" ContentType="application/'
+			'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+			'<Override PartName="/xl/worksheets/sheet1.xml" '
+			'ContentType="application/'
+			'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+			'</Types>'
+		).format(namespace),
+		'_rels/.rels': (
+			'<Relationships xmlns="{0}/package/2006/relationships">'
+			'<Relationship Id="rId1" Type="{1}/officeDocument" '
+			'Target="xl/workbook.xml"/></Relationships>'
+		).format(namespace, relationships),
+		'xl/workbook.xml': (
+			'<workbook xmlns="{0}/spreadsheetml/2006/main" '
+			'xmlns:r="{1}"><sheets><sheet name="Mailling" sheetId="1" '
+			'r:id="rId1"/></sheets></workbook>'
+		).format(namespace, relationships),
+		'xl/_rels/workbook.xml.rels': (
+			'<Relationships xmlns="{0}/package/2006/relationships">'
+			'<Relationship Id="rId1" Type="{1}/worksheet" '
+			'Target="worksheets/sheet1.xml"/></Relationships>'
+		).format(namespace, relationships),
+		'xl/worksheets/sheet1.xml': (
+			'<worksheet xmlns="{0}/spreadsheetml/2006/main">'
+			'<dimension ref="A1:{1}{2}"/>'
+			'<sheetData>{3}</sheetData></worksheet>'
+		).format(
+			namespace,
+			chr(64 + max(len(x) for x in rows)),
+			len(rows),
+			''.join(sheet)
+		)
+	}
+
+	with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as f:
+		for name, content in files.items():
+			f.writestr(name, '<?xml version="1.0" encoding="UTF-8" '
+				'standalone="yes"?>\n' + content)
+
+
+def mailling(archive, size):
+	'''Write a synthetic mailling with the addresses of addresses().
+
+	The columns are Receiver, Address, Number, Complement and City.
+	'''
+
+	rows = [['Receiver', 'Address', 'Number', 'Complement', 'City']]
+
+	for i, address in enumerate(addresses(size)):
+		rows.append(['{:08d}'.format(i)] + address + ['Porto Alegre'])
+
+	workbook(archive, rows)
+
+
+def timed(stages, stage, function):
+	'''Wrap a function so the seconds of every call go to its stage.'''
+
+	def wrapper(*args, **kwargs):
+		start = time.perf_counter()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			stages[stage].append(time.perf_counter() - start)
+
+	return wrapper
+
+
+def percentiles(times):
+	'''Return a line with the median, p95, p99 and max of the times.'''
+
+	times = sorted(times)
+
+	def at(ratio):
+		return times[min(int(len(times) * ratio), len(times) - 1)] * 1000
+
+	return '{} calls, {:.1f} ms median, {:.1f} ms p95, {:.1f} ms p99, ' \
+		'{:.1f} ms max'.format(len(times), at(0.5), at(0.95), at(0.99), 
+			times[-1] * 1000)
+
+
+def throughput(size=2000, workers=init.workers, latency=0.05, errors=0.01, 
+	memory=True):
+	'''Run crawler() on a synthetic mailling against stand-in servers.
+
+	Google and Correios are replaced by local servers with canned 
+	answers, so the run costs no API quota. Everything else is the 
+	real crawler() in batch mode, in a temporary folder, with fresh 
+	caches and without the delay between requests.
+
+	Args:
+		size: the number of rows in the mailling.
+		workers: passed to crawler().
+		latency: the mean seconds each server takes to answer.
+		errors: the rate of failed answers of each server.
+		memory: if True, the peak memory is traced, which makes the 
+			run itself slower.
+	'''
+
+	google, geocoding = serve(
+		responses(1000),
+		latency,
+		errors,
+		'<?xml version="1.0" encoding="UTF-8"?><GeocodeResponse>'
+		'<status>OVER_QUERY_LIMIT</status></GeocodeResponse>'
+	)
+	correios, searching = serve(pages(1000), latency, errors)
+
+	folder = tempfile.mkdtemp()
+
+	# init joins its folders with backslashes, which only nest on 
+	# Windows. Elsewhere they're flat names beginning with 'benchmark', 
+	# still removed with the temporary folder
+	settings = {
+		'path': os.path.join(folder, 'benchmark'),
+		'geocoding': geocoding,
+		'searching': searching,
+		'endpoint': 'xml',
+		'delay': 0
+	}
+	original = {x: getattr(init, x) for x in settings}
+	functions = ('google', 'parse', 'correios')
+	originals = {x: getattr(init, x) for x in functions}
+
+	# The mailling is given to crawler() as is, so nothing is asked
+	archive = os.path.join(folder, 'synthetic.xlsx')
+	positions = [0, -1, 1, 2, 3, 4, -1]
+
+	stages = collections.defaultdict(list)
+
+	try:
+		for key, value in settings.items():
+			setattr(init, key, value)
+
+		for directory in ('\\Database\\Journal', '\\Database\\Review', 
+			'\\Logs'):
+			os.makedirs(init.path + directory)
+
+		mailling(archive, size)
+
+		init.caches.clear()
+		init.storages.clear()
+
+		for function in functions:
+			setattr(init, function, timed(stages, function, originals[function]))
+
+		if memory:
+			tracemalloc.start()
+
+		start = time.perf_counter()
+
+		try:
+			with open(os.devnull, 'w') as null, \
+				contextlib.redirect_stdout(null):
+				init.crawler(workers=workers, batch=True, 
+					positions=positions, mailling=archive)
+		finally:
+			elapsed = time.perf_counter() - start
+			peak = tracemalloc.get_traced_memory()[1] if memory else None
+			tracemalloc.stop()
+
+	finally:
+		for key, value in original.items():
+			setattr(init, key, value)
+		for key, value in originals.items():
+			setattr(init, key, value)
+
+		for connection in init.caches.values():
+			connection.connection.close()
+		for engine in init.storages.values():
+			engine.connection.close()
+		init.caches.clear()
+		init.storages.clear()
+
+		google.shutdown()
+		correios.shutdown()
+		shutil.rmtree(folder, ignore_errors=True)
+
+	print('End-to-end crawler ({} rows, {} workers, {:.0f} ms latency, '
+		'{:.0%} errors)'.format(size, workers, latency * 1000, errors))
+	print('    {:.1f}s, {:.1f} rows/s'.format(elapsed, size / elapsed))
+
+	for stage in functions:
+		if stages[stage]:
+			print('    {}: {}'.format(stage, percentiles(stages[stage])))
+
+	for stage, url in (('google', geocoding), ('correios', searching)):
+		times = init.pool.latency.get(urllib.parse.urlsplit(url).netloc)
+		if times:
+			print('    {} http: {}'.format(stage, percentiles(times)))
+
+	for name, value in sorted(init.metrics.counters.items()):
+		print('    {}: {}'.format(name, value))
+
+	if peak is not None:
+		print('    peak memory: {:.1f} MB'.format(peak / 1024 / 1024))
+
+
+def main():
+	parser()
+	accent()
+	geocode()
+	correios()
+	throughput()
+
+
+if __name__ == '__main__':
+
+	main()
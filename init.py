@@ -1,17 +1,59 @@
-import bs4
+import bisect
+import collections
+import contextlib
+import csv
+import functools
+import glob
+import itertools
+import json
+import math
 import os
 import pickle
+import queue
 import re
+import shutil
+import sqlite3
+import string
+import sys
+import threading
 import time
 import unicodedata
 import urllib.parse
-import urllib.request
-import xlrd
-import xml.etree.ElementTree
+import zlib
+from html.parser import HTMLParser
 
 
 # Needs to be bound to os.getcwd
-path = r'C:\Users\User\Documents\'
+path = r'C:\Users\User\Documents'
+
+# Number of rows looked up at the same time by crawler()
+workers = 4
+
+# Seconds each lookup waits after querying Google, to respect the 
+# request limits of the API
+delay = 2
+
+# Format of the Google Maps Geocode API responses, 'xml' or 'json'
+endpoint = 'xml'
+
+# Seconds a Google answer stays in the geocode cache
+expiration = 30 * 24 * 60 * 60
+
+# Maximum number of addresses kept in the geocode cache
+capacity = 200000
+
+# Seconds a negative Correios answer stays in the cache, shorter than 
+# the others because the address may be fixed in the meantime
+rejection = 7 * 24 * 60 * 60
+
+# Seconds to wait for a connection or an answer before giving up
+timeout = 30
+
+# Where the Google Maps Geocode API and the Correios search are found
+geocoding = 'https://maps.googleapis.com/maps/api/geocode/'
+searching = ('http://www.buscacep.correios.com.br/'
+	'sistemas/buscacep/'
+	'resultadoBuscaCep.cfm')
 
 
 class Parser():
@@ -95,36 +137,239 @@ class Parser():
 		return self.info[self.indice[6]] if self.indice[6] != -1 else ''
 
 
-def generator(folder, message):
+def generator(folder, message, columns=None, archive=None):
 	'''Iterate through every row in the spreadsheet.
 	
-	Open the desired spreadsheet and iterate through every row and 
-	column, generating a temporary list with all the cells in the 
-	current row.
+	Open the desired spreadsheet and iterate through every row, 
+	generating a temporary list with the cells in the current row.
+
+	Args:
+		folder: the folder inside Spreadsheets with the documents.
+		message: the message shown when asking for the document.
+		columns: the indices of the columns that are needed. If given, 
+			only those cells are read and every other cell in the row 
+			is left empty.
+		archive: the path of the document. If given, the user isn't 
+			asked for it.
 	
 	Yields:
 		A list with all the information contained in that row.
 	'''
 
-	directory = path + '\\Spreadsheets' + folder
-	archive = load(directory, 'xls|xlsx', message)
+	if archive is None:
+		directory = path + '\\Spreadsheets' + folder
+		archive = load(directory, 'xls|xlsx', message)
+	else:
+		archive = archive, basename(archive)
 
-	workbook = xlrd.open_workbook(archive[0])
-	
-	for sheet in workbook.sheets():
+	start = time.perf_counter()
+
+	for cell, row, total in spreadsheet(archive[0], columns):
+		metrics.add('spreadsheet', time.perf_counter() - start)
+		yield cell, row, total, archive[1]
+		start = time.perf_counter()
+
+
+def spreadsheet(archive, columns=None, sheets=None):
+	'''Read the rows of a workbook without loading all of it.
+
+	Sheets are loaded on demand and released as soon as they're read. 
+	If openpyxl is installed, xlsx documents are read with its read-only 
+	mode, wich streams the rows straight from the file.
+
+	Args:
+		archive: the path of the workbook.
+		columns: the indices of the columns that are needed, or None 
+			for all of them.
+		sheets: the indices of the sheets to read, or None for all of 
+			them.
+
+	Yields:
+		A list with the cells of the row, the number of the row and the 
+		total of rows in the sheet.
+	'''
+
+	if re.search(r'\.xlsx$', archive):
+		try:
+			import openpyxl
+		except ImportError:
+			pass
+		else:
+			yield from worksheets(openpyxl, archive, columns, sheets)
+			return
+
+	import xlrd
+
+	workbook = xlrd.open_workbook(archive, on_demand=True)
+
+	if sheets is None:
+		sheets = range(workbook.nsheets)
+
+	try:
+		for i in sheets:
 	
-		# Specify the number of rows and columns 
-		cols, rows = sheet.ncols, sheet.nrows
+			sheet = workbook.sheet_by_index(i)
+
+			# Specify the number of rows and columns 
+			cols, rows = sheet.ncols, sheet.nrows
 		
-		for row in range(1,rows):
+			for row in range(1,rows):
 		
-			# Generate the row content
-			cell = [sheet.cell_value(
-				rowx=row,
-				colx=x
-			) for x in range(cols)]
+				# Generate the row content
+				if columns is None:
+					cell = sheet.row_values(row)
+				else:
+					cell = [''] * cols
+					for x in columns:
+						if x < cols:
+							cell[x] = sheet.cell_value(row, x)
 							
-			yield cell, row, rows - 1, archive[1]
+				yield cell, row, rows - 1
+
+			workbook.unload_sheet(i)
+
+	finally:
+		workbook.release_resources()
+
+
+def worksheets(openpyxl, archive, columns, sheets=None):
+	'''Stream the rows of a xlsx workbook, as spreadsheet() does.'''
+
+	workbook = openpyxl.load_workbook(
+		archive,
+		read_only=True,
+		data_only=True
+	)
+
+	# There is no need to read past the last projected column
+	last = max(columns) + 1 if columns else None
+
+	if sheets is None:
+		sheets = range(len(workbook.worksheets))
+
+	try:
+		for sheet in [workbook.worksheets[x] for x in sheets]:
+
+			total = (sheet.max_row or 1) - 1
+
+			# Rows are as wide as the sheet, as xlrd gives them
+			cols = sheet.max_column or 0
+
+			values = sheet.iter_rows(
+				min_row=2,
+				max_col=last,
+				values_only=True
+			)
+
+			for row, value in enumerate(values, 1):
+
+				# Empty cells are given as None, xlrd gives ''
+				if columns is None:
+					cell = ['' if x is None else x for x in value]
+					cell += [''] * (cols - len(cell))
+				else:
+					cell = [''] * max(cols, len(value))
+					for x in columns:
+						if x < len(value) and value[x] is not None:
+							cell[x] = value[x]
+
+				yield cell, row, total
+
+	finally:
+		workbook.close()
+
+
+def basename(archive):
+	'''Return the name of a document, without its folder and extension.'''
+	return re.split(r'\.\w+$', re.split(r'[\\/]', archive)[-1])[0]
+
+
+def tabs(archive):
+	'''Return the number of sheets of a workbook.'''
+
+	if re.search(r'\.xlsx$', archive):
+		try:
+			import openpyxl
+		except ImportError:
+			pass
+		else:
+			workbook = openpyxl.load_workbook(archive, read_only=True)
+			try:
+				return len(workbook.worksheets)
+			finally:
+				workbook.close()
+
+	import xlrd
+
+	workbook = xlrd.open_workbook(archive, on_demand=True)
+	try:
+		return workbook.nsheets
+	finally:
+		workbook.release_resources()
+
+
+def sheet(task):
+	'''Read all the rows of a single sheet, inside a worker process.'''
+	archive, i, columns = task
+	return list(spreadsheet(archive, columns, [i]))
+
+
+def workbooks(folder, columns=None, processes=None):
+	'''Iterate through the rows of every workbook in a folder.
+
+	Every sheet of every workbook is read by a process pool, so a whole 
+	month of maillings is read in the time of the largest sheets. The 
+	rows come out in the order of the files and sheets, and a row with 
+	the same cells as an earlier one of the same workbook is left out. 
+	Rows repeated in other workbooks are kept, so each workbook still 
+	gets its record, but the pipeline looks their address up only once.
+
+	Args:
+		folder: a folder inside Spreadsheets, or a pattern such as 
+			'\\Mailling\\*.xlsx'.
+		columns: the indices of the columns that are needed, as in 
+			generator().
+		processes: the number of processes, or None for one per CPU.
+
+	Yields:
+		The same tuples as generator(), each one with the name of the 
+		workbook it came from.
+	'''
+
+	directory = path + '\\Spreadsheets' + folder
+
+	if os.path.isdir(directory):
+		directory += '\\*'
+
+	listing = sorted(
+		x for x in glob.glob(directory) if re.search(r'\.xlsx?$', x)
+	)
+
+	import concurrent.futures
+
+	seen = set()
+
+	with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+
+		tasks = [(x, i, columns)
+			for x, count in zip(listing, executor.map(tabs, listing))
+			for i in range(count)]
+
+		for task, rows in zip(tasks, executor.map(sheet, tasks)):
+
+			name = basename(task[0])
+
+			for cell, row, total in rows:
+
+				key = (name,) + tuple(receiver(x) for x in cell)
+
+				if key in seen:
+					metrics.count('duplicate rows')
+					continue
+
+				seen.add(key)
+
+				yield cell, row, total, name
 
 
 def index():
@@ -165,489 +410,2362 @@ def index():
 	
 def request(url, post):
 	'''Fire a request to the given url and returns the whole page.'''
-	req = urllib.request.urlopen(url, post).read()
+	req = pool.fetch(url, post)
 	page = req.decode('utf-8', 'ignore')
 	
 	return page
 
-## -------------------- Google Maps Geocode API --------------------
+## -------------------- http connections --------------------
 
-def google(address):
-	'''Fetch and parse the information from Google Maps Geocode API.
-	
-	The data will be fetched from a simple request. The recieved info will be 
-	bound to a variable (as a string) and will contain all the response in 
-	XML format.
-	
-	Args:
-		address: the raw address from the spreadsheet.
-		
-	Raises:
-		AttributeError: while looping through the results of the xml 
-			response, if the children doesn't have a 'type' tag, 
-			it will raise an exception and try to search for the 
-			'location' tag.
-		TypeError: after fail in the search for a 'type' tag, it will attempt 
-			to search for a 'location' tag. And if still don't find anything, 
-			will raise a TypeError beacause one of the tags that match 
-			doesn't have any children element (<location_type>).
-			
-	Returns:
-		A list containing all the information fetched by Google. The list 
-		will have a determined order as follow:
-		
-		info = [
-			street_number, route,
-			administrative_area_level_2, administrative_area_level_1,
-			lat, lng
-		]
-		
-		If the response from Google it's not positive, then will return 
-		the response message itself.
-	'''
-	
-	# Series of functions that will be matched and fetched as pairs
-	# for each keyword
-	# Because both short and long name are needed, 
-	# we have to specify in wich keyword we need them
-	
-	def findStreet(element):
-		return re.search('route', element.text)
-	
-	def getStreet(element):
-		name = element.find('long_name')
-		street = name.text
-		return street
-		
-	def findNumber(element):
-		return re.search('number', element.text)
-		
-	def getNumber(element):
-		name = element.find('long_name')
-		number = name.text
-		return number
-	
-	def findCity(element):
-		return re.search('administrative_area_level_2', element.text)
-		
-	def getCity(element):
-		name = element.find('long_name')
-		city = name.text
-		return city
-		
-	def findState(element):
-		return re.search('administrative_area_level_1', element.text)
-	
-	def getState(element):
-		name = element.find('short_name')
-		state = name.text
-		return state
-	
-	# Pack of functions that will match and then return a specific 
-	# element
-	functions = [
-		(findStreet, getStreet),
-		(findNumber, getNumber),
-		(findCity, getCity),
-		(findState, getState)
-	]
+class Pool():
+	'''Keep the connections to each host open between requests.
 
-	link = 'https://maps.googleapis.com/maps/api/geocode/xml?address='
-	
-	# Need to encode the address to be a valid url
-	encode = urllib.parse.quote_plus(address)
-	url = link + encode
-	
-	# The XML content as a string
-	req = request(url, None)	
-	
-	# Generate log files
-	directory = path + '\\Logs\\' + r'{}.xml'.format(address)
-	with open(directory, 'w') as f:
-		f.write(req)
-	
-	root = xml.etree.ElementTree.fromstring(req)
-	
-	status = root.find('status')
-	response = status.text
-	
-	# Look for the status of the response
-	# If negative, return the response message
-	if response == 'OK':
+	Opening a connection costs a TCP handshake, plus a TLS one for 
+	Google, which is a large share of a lookup. The idle connections 
+	of each host are kept in a queue, so every worker thread takes 
+	one, uses it and gives it back. Responses are asked gzipped, and 
+	the time of every request is kept per host.
+	'''
 
-		data = []
+	def __init__(self, timeout):
+		self.timeout = timeout
+		self.idle = collections.defaultdict(queue.LifoQueue)
+		self.latency = collections.defaultdict(list)
+		self.lock = threading.Lock()
 
-		for result in root.findall('result'):
+	def connect(self, scheme, host, fresh=False):
+		'''Return an idle connection to the host, or a new one.'''
 
-			info = []
+		import http.client
 
-			for children in result:
-		
-				try:
-					type = children.find('type')							
-					# Search for the keyword and return it's value if found 
-					for pattern, match in functions:
-						if pattern(type):					
-							info.append(match(children))
-									
-				# Search for location	
-				except AttributeError:
-			
-					try:
-						location = children.find('location')
-						# Find lat and lng (the only children)				
-						for coordinates in location:
-							info.append(coordinates.text)
-										
-					except TypeError:
-						continue			
-		
-			data.append(info)
+		if not fresh:
+			try:
+				return self.idle[scheme, host].get_nowait()
+			except queue.Empty:
+				pass
 
-		return data, response
-	
-	else:
-		return response	
-		
-## -------------------- Correios parser --------------------
+		if scheme == 'https':
+			return http.client.HTTPSConnection(host, timeout=self.timeout)
+		return http.client.HTTPConnection(host, timeout=self.timeout)
 
-def correios(data):
-	'''Send information to Correios web page and return a valid zip code.
-	
-	The information returned by Google will be used as the data to be 
-	sent in this request. Because the info is already formated, there's no 
-	need to edit or parse the data, only alocate the correct indexes of 
-	the list.
-	
-	Args:
-		data: data will be a list with the needed information to perform 
-			a post request to the Correios web page.
-			
-	Returns:
-		If more than one zip code is found, it will return a list containing 
-		all possible matches. The user is the one that has to decide wich 
-		of the found numbers is the correct one. If only one is found, then 
-		it returns the same list, but with only one item long. The list will 
-		contain information as follow:
-		
-		info = [
-			street, neighborhood,
-			city, zip code 
-		]
-		
-		Also, if it's a bad address, may not give any usefull information, 
-		in wich case it will return the message found on the web page. 
-	'''
-	
-	link = ('http://www.buscacep.correios.com.br/'
-			'sistemas/buscacep/'
-			'resultadoBuscaCep.cfm')
+	def fetch(self, url, post, redirects=5):
+		'''Return the body of the page, following redirects like urlopen.
 
-	post = {
-		'UF': data[3],
-		'Localidade': accent(data[2]),
-		'Logradouro': accent(data[1]),
-		'Numero': data[0],
-		'Submit': 'Buscar'
-	}
-	
-	# Need to encode the content of the request
-	encode = urllib.parse.urlencode(post).encode()
-	
-	req = request(link, encode)
-	
-	# Bind the HTML content to a BeautifulSoup element
-	html = bs4.BeautifulSoup(req, 'html.parser')
-	
-	# Search for the positive response
-	find = html.find_all('p')
-	
-	# The last p tag is the response
-	response = find[-1].text
-	
-	if not re.search('NAO', response):
+		Raises:
+			urllib.error.HTTPError: the server answered with an error.
+		'''
 
-		# Find the table wich contains all the information
-		table = html.find_all('table')
-		
-		rows = table[0].find_all('tr')
-		info = []
-		
-		# If the table has more than two rows, it means that will 
-		# return more than one zip code
-		if len(rows) > 2:
-			
-			for row in rows[1:]:		
-				# Generate a list for each of the given zip codes
-				zip_code = [x.text for x in row.find_all('td')]
-				info.append(zip_code)
-		
-		# If there's only one zip code, return all the elements of the row
+		import http.client
+		import urllib.error
+
+		parts = urllib.parse.urlsplit(url)
+		target = parts.path or '/'
+		if parts.query:
+			target += '?' + parts.query
+
+		method = 'POST' if post is not None else 'GET'
+		headers = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'}
+		if post is not None:
+			headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+		start = time.perf_counter()
+
+		# A kept connection may have been closed by the server while 
+		# idle, which only shows when it's used, so try a new one once
+		for attempt in range(2):
+			connection = self.connect(parts.scheme, parts.netloc, attempt)
+			try:
+				connection.request(method, target, post, headers)
+				response = connection.getresponse()
+				body = response.read()
+				break
+			except (http.client.RemoteDisconnected, ConnectionError):
+				connection.close()
+				if attempt:
+					raise
+			except:
+				connection.close()
+				raise
+
+		if response.will_close:
+			connection.close()
 		else:
-			zip_code = [x.text for x in rows[1].find_all('td')]
-			info.append(zip_code)
-		
-		return info
-	
-	# If it's a negative response, returne the message	
-	else:
-		return response
-	
-## -------------------- address analisys --------------------
+			self.idle[parts.scheme, parts.netloc].put(connection)
 
-def addressParser(data):
-	'''Analyze and parse the address, returning street name, number 
-	and complement if present and as separate fields.
+		with self.lock:
+			self.latency[parts.netloc].append(time.perf_counter() - start)
 
-	Because some of the addresses have different formating, there is a 
-	necessity to analyze each one and return separate values for street 
-	name,street number and complement.
+		if response.getheader('Content-Encoding') == 'gzip':
+			body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
 
-	Args:
-		data: the original address. May be a string or a list with street 
-			name, street number and complement if they are in separate fields.
+		if response.status in (301, 302, 303, 307, 308) and redirects:
+			location = urllib.parse.urljoin(url, response.getheader('Location'))
+			if response.status in (307, 308):
+				return self.fetch(location, post, redirects - 1)
+			return self.fetch(location, None, redirects - 1)
 
-	Return:
-		If doesn't have a number column and can't find more than 
-		one item if splitted, will then search for a number and, 
-		if still can't find any number, will return false. It will 
-		return the address itself if can't split the address between 
-		a comma, but only if a number is found. The full form is a list 
-		containig the street address, the number and complement, all as 
-		separate elements that can be used later.
-	'''
-	
-	sequence = [str(x) for x in data]
-	
-	pattern = [
-		r'\d{1,4}',
-		r'(\d{1,4})',
-		r'^\s*'
-	]
-	
-	string = ' '.join(sequence).replace(',', '')
-	
-	# Find a number
-	address = string if re.search(pattern[0], string) else False
-	
-	if address != False:
-		street, complement = re.split(
-			pattern[0],
-			address,
-			maxsplit=1
-		)
-		# Replace any whitespace in the beginning
-		complement = re.sub(pattern[2], '', complement)
-		# Validate the complement
-		complement = False if not complement else complement
-		
-		number = re.search(pattern[1], address).groups(0)[0]
+		if response.status >= 400:
+			raise urllib.error.HTTPError(
+				url, response.status, response.reason, response.msg, None
+			)
 
-		return street, number, complement
-		
-	else:
-		return address
+		return body
 
-## -------------------- ascii converter --------------------	
+	def report(self):
+		'''Return a line per host with the latency of its requests.'''
+		lines = []
 
-def accent(string):
-	'''Remove any special characters of a string.
+		with self.lock:
+			for host, times in sorted(self.latency.items()):
+				times = sorted(times)
+				lines.append(
+					'{}: {} requests, {:.0f} ms mean, {:.0f} ms median, '
+					'{:.0f} ms p95, {:.0f} ms max'.format(
+						host,
+						len(times),
+						sum(times) / len(times) * 1000,
+						times[len(times) // 2] * 1000,
+						times[int(len(times) * 0.95)] * 1000,
+						times[-1] * 1000
+					)
+				)
 
-	Strings containing special characters can't be passed into a 
-	post request and sometimes can't be printed in the terminal.
+		return '\n'.join(lines)
 
-	Args:
-		string: a string that may or may not have any special 
-		characters on it.
+	def reset(self):
+		'''Forget the latencies, so the report covers a single run.'''
+		with self.lock:
+			self.latency.clear()
 
-	Returns:
-		word: the same string containing only ASCII characters.
-	'''
 
-	word = ''.join(x for x in unicodedata.normalize('NFD', string) if
-		unicodedata.category(x) != 'Mn'
-	)
-	return word
-	
-## -------------------- web crawler --------------------
+pool = Pool(timeout)
 
-def crawler():
+## -------------------- run metrics --------------------
 
-	# Generate a list of indexes
-	positions = index()
-	
-	# All the information will be stored here
-	data, name = [], None
+class Metrics():
+	'''Count the events and time the stages of a run.
 
-	message = 'Choose the original mailling:'
-	directory = '\\Mailling'
-	for row in generator(directory, message):
+	The time of each stage is kept as a histogram, so the memory used 
+	doesn't grow with the number of rows. Every method can be called 
+	from the worker threads.
+	'''
 
-		name = row[3]
-	
+	# Upper bounds, in seconds, of the buckets of every histogram
+	bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 
+		1, 2, 5, 10, 30)
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		'''Forget everything, so the metrics cover a single run.'''
+		with self.lock:
+			self.counters = collections.Counter()
+			self.timings = {}
+			self.start = time.perf_counter()
+
+	def count(self, name, value=1):
+		'''Add to a counter.'''
+		with self.lock:
+			self.counters[name] += value
+
+	def add(self, stage, seconds):
+		'''Add the time of a single call to the histogram of a stage.'''
+
+		with self.lock:
+			if stage not in self.timings:
+				self.timings[stage] = {
+					'count': 0,
+					'total': 0.0,
+					'max': 0.0,
+					'buckets': [0] * (len(self.bounds) + 1)
+				}
+
+			timing = self.timings[stage]
+			timing['count'] += 1
+			timing['total'] += seconds
+			timing['max'] = max(timing['max'], seconds)
+			timing['buckets'][bisect.bisect_left(self.bounds, seconds)] += 1
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		'''Time the block inside the with statement.'''
+
+		start = time.perf_counter()
 		try:
-			print('\n{}/{}\n{}'.format(
-				row[1],		# Current address
-				row[2],		# Total addresses 
-				row[0]		# Data
-			))
-		except UnicodeEncodeError:
-			print('\n{}/{}\n{}'.format(
-				row[1],		# Current address
-				row[2],		# Total addresses 
-				'Can\'t decode special character.'		# Data
-			))
+			yield
+		finally:
+			self.add(name, time.perf_counter() - start)
+
+	def progress(self, done, total):
+		'''Return a line with the rows per second and the time left.'''
+
+		elapsed = time.perf_counter() - self.start
+		rate = self.counters['rows'] / elapsed if elapsed else 0
+		left = max(total - done, 0) / rate if rate else 0
+
+		return '{:.1f} rows/s, ETA {}'.format(
+			rate,
+			time.strftime('%H:%M:%S', time.gmtime(left))
+		)
+
+	def dump(self, name):
+		'''Write the counters and histograms of the run as JSON.
+
+		The file goes in the Logs folder, with the name given.
+
+		Returns:
+			The path of the file.
+		'''
+
+		labels = ['<= {:g} ms'.format(x * 1000) for x in self.bounds]
+		labels.append('> {:g} ms'.format(self.bounds[-1] * 1000))
+
+		with self.lock:
+			report = {
+				'seconds': time.perf_counter() - self.start,
+				'counters': dict(self.counters),
+				'stages': {stage: {
+					'count': timing['count'],
+					'total': timing['total'],
+					'mean': timing['total'] / timing['count'],
+					'max': timing['max'],
+					'histogram': dict(zip(labels, timing['buckets']))
+				} for stage, timing in self.timings.items()}
+			}
+
+		directory = path + '\\Logs'
+		db = r'{}\{}.json'.format(directory, name)
+
+		with open(db, 'w', encoding='utf-8') as f:
+			json.dump(report, f, ensure_ascii=False, indent=1)
+
+		return db
+
+
+metrics = Metrics()
+
+## -------------------- disk cache --------------------
+
+class Cache():
+	'''Keep the answers of slow lookups in a SQLite table.
+
+	Every entry is stored as a pickled value bound to a string key, 
+	together with the moment it expires and the last time it was read. 
+	Expired entries are dropped when found, and once the table holds 
+	more entries than allowed, the least recently read ones are removed. 
+	Tables without a size limit are never trimmed.
+
+	Reading an entry doesn't write to the disk. The read times are kept 
+	in memory and written by evict(), before they're needed to choose 
+	what goes, or by flush() at the end of a run.
+	'''
+
+	def __init__(self, db, table, ttl, size):
+		'''Open (or create) the table that will hold the entries.
+
+		Args:
+			db: the path of the SQLite file.
+			table: the name of the table inside the file.
+			ttl: how many seconds an entry is valid by default.
+			size: the maximum number of entries kept in the table, or 
+				None to keep every entry.
+		'''
+
+		self.table = table
+		self.ttl = ttl
+		self.size = size
+		self.writes = 0
+
+		# The last read time of the keys read since the last write
+		self.accessed = {}
+
+		# Counters reported at the end of each run
+		self.hits = 0
+		self.misses = 0
+
+		# The same connection is shared by the crawler threads
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(db, check_same_thread=False)
+
+		# Writes only wait for the disk at checkpoints, and reads don't 
+		# wait for them
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA synchronous=NORMAL')
+
+		with self.connection:
+			self.connection.execute(
+				'CREATE TABLE IF NOT EXISTS {} ('
+				'key TEXT PRIMARY KEY, value BLOB, '
+				'expires REAL, accessed REAL)'.format(table)
+			)
+			self.connection.execute(
+				'CREATE INDEX IF NOT EXISTS {0}_accessed '
+				'ON {0} (accessed)'.format(table)
+			)
+
+	def get(self, key):
+		'''Return the value bound to the key, or None if not found.'''
+
+		now = time.time()
+
+		with self.lock, self.connection:
+			row = self.connection.execute(
+				'SELECT value, expires FROM {} WHERE key = ?'.format(
+					self.table
+				),
+				(key,)
+			).fetchone()
+
+			if row is None:
+				self.misses += 1
+				return None
+
+			# Expired entries are removed as soon as they're found
+			if row[1] < now:
+				self.connection.execute(
+					'DELETE FROM {} WHERE key = ?'.format(self.table),
+					(key,)
+				)
+				self.misses += 1
+				return None
+
+			self.hits += 1
+			self.accessed[key] = now
+
+		return pickle.loads(row[0])
+
+	def put(self, key, value, ttl=None):
+		'''Bind the value to the key, replacing any previous entry.
+
+		Args:
+			key: a string identifying the lookup.
+			value: any object that can be pickled.
+			ttl: the seconds this entry is valid, if different from the 
+				default of the table.
+		'''
+
+		now = time.time()
+		ttl = self.ttl if ttl is None else ttl
+
+		with self.lock, self.connection:
+			self.connection.execute(
+				'INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(
+					self.table
+				),
+				(key, pickle.dumps(value), now + ttl, now)
+			)
+
+			# Counting the rows on every write would be too slow
+			self.writes += 1
+			if self.writes % 100 == 0:
+				self.evict()
+
+	def put_many(self, items, ttl=None):
+		'''Bind many values at once, in a single transaction.
+
+		Args:
+			items: an iterable of key and value pairs, as in put().
+			ttl: the seconds these entries are valid, as in put().
+		'''
+
+		now = time.time()
+		ttl = self.ttl if ttl is None else ttl
+
+		with self.lock, self.connection:
+			self.connection.executemany(
+				'INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(
+					self.table
+				),
+				((key, pickle.dumps(value), now + ttl, now)
+					for key, value in items)
+			)
+
+			self.evict()
+
+	def flush(self):
+		'''Write the read times still kept in memory.'''
+
+		with self.lock, self.connection:
+			self.evict()
+
+	def evict(self):
+		'''Remove the entries read the longest ago above the size limit.'''
+
+		self.connection.executemany(
+			'UPDATE {} SET accessed = ? WHERE key = ?'.format(self.table),
+			((accessed, key) for key, accessed in self.accessed.items())
+		)
+		self.accessed.clear()
+
+		if self.size is None:
+			return
+
+		count = self.connection.execute(
+			'SELECT COUNT(*) FROM {}'.format(self.table)
+		).fetchone()[0]
+
+		if count > self.size:
+			self.connection.execute(
+				'DELETE FROM {0} WHERE key IN ('
+				'SELECT key FROM {0} ORDER BY accessed LIMIT ?)'.format(
+					self.table
+				),
+				(count - self.size,)
+			)
+
+	def report(self):
+		'''Return a line with the hits and misses of this run.'''
+		total = self.hits + self.misses
+		ratio = self.hits / total * 100 if total else 0
+
+		return '{}: {} hits, {} misses ({:.1f}%)'.format(
+			self.table,
+			self.hits,
+			self.misses,
+			ratio
+		)
+
+
+# Every cache already opened, bound by the name of its table
+caches = {}
+caches_lock = threading.Lock()
+
+
+def cache(table, ttl, size):
+	'''Return the cache bound to the table, opening it if needed.
+
+	All the tables live in the same file, inside the Database folder.
+	'''
+
+	with caches_lock:
+		if table not in caches:
+			db = path + '\\Database\\cache.db'
+			caches[table] = Cache(db, table, ttl, size)
+
+	return caches[table]
+
+
+def normalize(string):
+	'''Fold accents, case and whitespace so equal addresses share a key.'''
+	return ' '.join(accent(string).lower().split())
+	
+## -------------------- response archive --------------------
+
+class Archive():
+	'''Keep the raw Geocode responses of a run in a compressed file.
+
+	Every response is compressed on its own and appended to a single 
+	.log file per run, while a line with its address, offset and length 
+	is appended to an .idx file next to it. All the writing is done by a 
+	background thread, so google() only has to put the response in a 
+	queue and never waits on the disk.
+	'''
+
+	def __init__(self, name):
+		'''Create the files of the run and start the writer thread.
+
+		Args:
+			name: the name of the run, used for both files inside the 
+				Logs folder.
+		'''
+
+		directory = path + '\\Logs'
+		self.log = r'{}\{}.log'.format(directory, name)
+		self.idx = r'{}\{}.idx'.format(directory, name)
+
+		self.queue = queue.Queue()
+		self.thread = threading.Thread(target=self.writer, daemon=True)
+		self.thread.start()
+
+	def put(self, address, response):
+		'''Queue a response to be written.'''
+		self.queue.put((address, response))
+
+	def writer(self):
+		'''Write the queued responses until close() is called.'''
+
+		with open(self.log, 'ab') as log, \
+			open(self.idx, 'a', encoding='utf-8') as idx:
+
+			offset = log.seek(0, os.SEEK_END)
+
+			while True:
+
+				item = self.queue.get()
+
+				if item is None:
+					break
+
+				data = zlib.compress(item[1].encode('utf-8'))
+				log.write(data)
+
+				idx.write(json.dumps(
+					[item[0], offset, len(data)],
+					ensure_ascii=False
+				) + '\n')
+
+				offset += len(data)
+
+				# Flush only when there's nothing else waiting
+				if self.queue.empty():
+					log.flush()
+					idx.flush()
+
+	def close(self):
+		'''Write everything still in the queue and stop the writer.'''
+		self.queue.put(None)
+		self.thread.join()
+
+
+def archived(log):
+	'''Yield every response kept in an archive.
+
+	Args:
+		log: the path of the .log file. The .idx file must be next to it.
+
+	Yields:
+		The address and the raw response, as strings.
+	'''
+
+	idx = re.sub(r'\.log$', '.idx', log)
+
+	with open(log, 'rb') as f, open(idx, 'r', encoding='utf-8') as lines:
+
+		for line in lines:
+
+			# The last line may be incomplete after a crash
+			try:
+				address, offset, length = json.loads(line)
+			except ValueError:
+				continue
+
+			f.seek(offset)
+			data = zlib.decompress(f.read(length))
+
+			yield address, data.decode('utf-8')
+	
+## -------------------- Google Maps Geocode API --------------------
+
+def google(address, archive=None, offline=False):
+	'''Fetch and parse the information from Google Maps Geocode API.
+	
+	The data will be fetched from a simple request. The recieved info will be 
+	bound to a variable (as a string) and will contain all the response in 
+	XML or JSON format, as set by endpoint, wich is parsed by parse().
+	
+	Args:
+		address: the raw address from the spreadsheet.
+		archive: the Archive of the run, where the raw response is kept. 
+			If None, the response isn't kept.
+		offline: if True, no request is made and only the addresses 
+			rebuilt by replay(), or else found in the geocode cache, are 
+			answered.
+			
+	Returns:
+		The same as parse(). If running offline and the address isn't in 
+		the cache, returns 'NOT_ARCHIVED'.
+
+		Positive and ZERO_RESULTS responses are kept in the geocode cache, 
+		so the same address won't be requested again until it expires. 
+		Answers from the cache don't wait for the delay.
+	'''
+
+	key = normalize(address)
+
+	# The archived responses, parsed again by replay(), come first
+	if offline:
+		stored = cache('replay', math.inf, None).get(key)
+		if stored is not None:
+			return stored
+
+	# Addresses already in the cache don't need a new request
+	geocode = cache('geocode', expiration, capacity)
+
+	stored = geocode.get(key)
+	if stored is not None:
+		return stored
+
+	if offline:
+		return 'NOT_ARCHIVED'
+
+	link = geocoding + '{}?address='.format(endpoint)
+	
+	# Need to encode the address to be a valid url
+	encode = urllib.parse.quote_plus(address)
+	url = link + encode
+	
+	# The XML or JSON content as a string
+	req = request(url, None)	
+
+	# Only real requests count for the request limits of the API
+	with metrics.stage('sleep'):
+		time.sleep(delay)
+	
+	# Keep the raw response
+	if archive is not None:
+		archive.put(address, req)
+
+	data = parse(req)
+
+	metrics.count('google ' + (data[1] if type(data) == tuple else data))
+
+	keep(address, data)
+
+	return data
+
+
+def answered(data):
+	'''Return True if a parsed response is a final answer.
+
+	Only final answers are cached, errors like OVER_QUERY_LIMIT 
+	must be requested again.
+	'''
+	return type(data) == tuple or data == 'ZERO_RESULTS'
+
+
+def keep(address, data):
+	'''Put the parsed response of an address in the geocode cache.'''
+
+	if answered(data):
+		geocode = cache('geocode', expiration, capacity)
+		geocode.put(normalize(address), data)
+
+
+# Slot of the record filled by each type of address component, and 
+# the name taken from it
+components = {
+	'street_number': (0, 'long_name'),
+	'route': (1, 'long_name'),
+	'administrative_area_level_2': (2, 'long_name'),
+	'administrative_area_level_1': (3, 'short_name')
+}
+
+
+def parse(req):
+	'''Parse a response from Google Maps Geocode API.
+
+	The response is parsed a single time, in XML or JSON depending on its 
+	content, and each address component is dispatched by its type 
+	through the components table to a fixed slot of the record.
+
+	Args:
+		req: the content of the response, as a string.
 			
-		# Any information regarding the original data will be fetched 
-		# by calling this object.	
-		delivery = Parser(row[0], positions)
+	Returns:
+		A list with a record for each result found by Google. Every 
+		record has the same slots, in the following order:
 		
-		raw_address = [
-			delivery.address(),
-			delivery.number(),
-			delivery.complement()
+		info = [
+			street_number, route,
+			administrative_area_level_2, administrative_area_level_1,
+			lat, lng
 		]
 
-		formatted_address = addressParser(raw_address)
+		If Google didn't find the street number, its slot is None. 
+		Missing names are empty strings.
+		
+		If the response from Google it's not positive, then will return 
+		the response message itself.
+	'''
+
+	if req.lstrip().startswith('{'):
+		return geocodeJSON(req)
+	else:
+		return geocodeXML(req)
+
+
+def geocodeXML(req):
+	'''Parse a response from the XML endpoint, as parse() does.'''
+
+	import xml.etree.ElementTree
+
+	root = xml.etree.ElementTree.fromstring(req)
+	response = root.findtext('status')
+
+	# If negative, return the response message
+	if response != 'OK':
+		return response
+
+	data = []
+
+	for result in root.iterfind('result'):
+
+		info = [None, '', '', '', None, None]
+
+		for children in result.iterfind('address_component'):
+
+			# The first type is the most specific one
+			slot = components.get(children.findtext('type'))
+
+			if slot is not None:
+				info[slot[0]] = children.findtext(slot[1])
+
+		location = result.find('geometry/location')
+
+		if location is not None:
+			info[4] = location.findtext('lat')
+			info[5] = location.findtext('lng')
+
+		data.append(info)
+
+	return data, response
+
+
+def geocodeJSON(req):
+	'''Parse a response from the JSON endpoint, as parse() does.
+
+	The coordinates are kept as strings, like in the XML responses.
+	'''
+
+	root = json.loads(req)
+	response = root.get('status')
+
+	# If negative, return the response message
+	if response != 'OK':
+		return response
+
+	data = []
+
+	for result in root.get('results', []):
+
+		info = [None, '', '', '', None, None]
+
+		for children in result.get('address_components', []):
+
+			types = children.get('types') or [None]
+			slot = components.get(types[0])
+
+			if slot is not None:
+				info[slot[0]] = children.get(slot[1])
+
+		location = result.get('geometry', {}).get('location')
+
+		if location is not None:
+			info[4] = str(location['lat'])
+			info[5] = str(location['lng'])
+
+		data.append(info)
+
+	return data, response
+
+
+def complete(info, number):
+	'''Fill the street number of a record if Google didn't find it.'''
+
+	# Records cached before the fixed slots don't have the number
+	if len(info) < 6:
+		info.insert(0, number)
+	elif info[0] is None:
+		info[0] = number
+		
+## -------------------- Correios parser --------------------
+
+class Page(HTMLParser):
+	'''Read only the parts of the Correios result page that are used.
+
+	Instead of building a whole tree of the page, the parser keeps just 
+	the text of the last <p> tag, with the status of the search, and 
+	the text of the cells of each row of the first <table>. Open tags 
+	are closed the same way BeautifulSoup closes them, so the texts are 
+	exactly the ones given by its .text attribute.
+	'''
+
+	# Tags that never have any content
+	void = {
+		'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command',
+		'embed', 'frame', 'hr', 'image', 'img', 'input', 'isindex',
+		'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param',
+		'source', 'spacer', 'track', 'wbr'
+	}
+
+	def __init__(self, page):
+		'''Parse the whole page at once.
+
+		Args:
+			page: the HTML content of the page, as a string.
+		'''
+
+		super().__init__(convert_charrefs=True)
+
+		# Every open tag, with the text or the cells it's collecting
+		self.stack = []
+
+		# Text found since the last tag
+		self.text = []
+
+		# Text of the last paragraph
+		self.last = None
+
+		# Rows of the first table, while inside it
+		self.rows = []
+		self.tables = 0
+		self.inside = False
+
+		self.feed(page)
+		self.close()
+		self.flush()
+
+	def flush(self):
+		'''Give the text found since the last tag to the open tags.'''
+
+		text = ''.join(self.text)
+		self.text = []
+
+		if not text:
+			return
+
+		# Like BeautifulSoup, whitespace between tags is collapsed
+		if not text.strip(' \n\t\f\r') and not any(
+			x[0] in ('pre', 'textarea') for x in self.stack
+		):
+			text = '\n' if '\n' in text else ' '
+
+		for tag, content in self.stack:
+			if tag in ('p', 'td') and content is not None:
+				content.append(text)
+
+	def handle_starttag(self, tag, attrs):
+
+		self.flush()
+
+		if tag in self.void:
+			return
+
+		content = None
+
+		if tag == 'p':
+			content = self.last = []
+
+		elif tag == 'table':
+			self.tables += 1
+			# The first table is marked to know when it's closed
+			if self.tables == 1:
+				self.inside = True
+				content = True
+
+		elif tag == 'tr' and self.inside:
+			content = []
+			self.rows.append(content)
+
+		elif tag == 'td' and self.inside:
+			content = []
+			# A cell belongs to every row still open
+			for x in self.stack:
+				if x[0] == 'tr' and x[1] is not None:
+					x[1].append(content)
+
+		self.stack.append((tag, content))
+
+	def handle_endtag(self, tag):
+
+		self.flush()
+
+		# Close every tag opened after the last one with this name
+		for i in range(len(self.stack) - 1, -1, -1):
+			if self.stack[i][0] == tag:
+				for x in self.stack[i:]:
+					if x[0] == 'table' and x[1] is True:
+						self.inside = False
+				del self.stack[i:]
+				break
+
+	def handle_data(self, data):
+		self.text.append(data)
+
+	def handle_comment(self, data):
+		# Comments split the text, but aren't part of it
+		self.flush()
+
+	def status(self):
+		'''Return the text of the last paragraph.
+
+		Raises:
+			IndexError: if the page has no paragraph at all.
+		'''
+
+		if self.last is None:
+			raise IndexError('The page has no paragraph.')
+
+		return ''.join(self.last)
+
+	def table(self):
+		'''Return the rows of the first table, each one as a list with 
+		the text of its cells.
+
+		Raises:
+			IndexError: if the page has no table at all.
+		'''
+
+		if not self.tables:
+			raise IndexError('The page has no table.')
+
+		return [[''.join(x) for x in row] for row in self.rows]
+
+
+def correios(data, offline=False):
+	'''Send information to Correios web page and return a valid zip code.
+	
+	The information returned by Google will be used as the data to be 
+	sent in this request. Because the info is already formated, there's no 
+	need to edit or parse the data, only alocate the correct indexes of 
+	the list.
+	
+	Args:
+		data: data will be a list with the needed information to perform 
+			a post request to the Correios web page.
+		offline: if True, no request is made and only the addresses 
+			found in the correios cache are answered.
+			
+	Returns:
+		If more than one zip code is found, it will return a list containing 
+		all possible matches. The user is the one that has to decide wich 
+		of the found numbers is the correct one. If only one is found, then 
+		it returns the same list, but with only one item long. The list will 
+		contain information as follow:
+		
+		info = [
+			street, neighborhood,
+			city, zip code 
+		]
+		
+		Also, if it's a bad address, may not give any usefull information, 
+		in wich case it will return the message found on the web page. 
+
+		Both answers are kept in the correios cache, the negative ones 
+		for a shorter time. If running offline and the address isn't in 
+		the cache, returns 'NOT_ARCHIVED'.
+	'''
+	
+	link = searching
+
+	post = {
+		'UF': data[3],
+		'Localidade': accent(data[2]),
+		'Logradouro': accent(data[1]),
+		'Numero': data[0],
+		'Submit': 'Buscar'
+	}
+	
+	# The same request always gets the same answer, including the 
+	# negative ones
+	zip_codes = cache('correios', expiration, capacity)
+	key = '|'.join(str(post[x]) for x in (
+		'UF',
+		'Localidade',
+		'Logradouro',
+		'Numero'
+	))
+
+	stored = zip_codes.get(key)
+	if stored is not None:
+		return stored
+
+	if offline:
+		return 'NOT_ARCHIVED'
+
+	# Need to encode the content of the request
+	encode = urllib.parse.urlencode(post).encode()
+	
+	req = request(link, encode)
+	
+	# Read only the paragraphs and the first table of the page
+	html = Page(req)
+	
+	# The last p tag is the response
+	response = html.status()
+	
+	if not re.search('NAO', response):
+
+		# The table wich contains all the information
+		rows = html.table()
+		info = []
+		
+		# If the table has more than two rows, it means that will 
+		# return more than one zip code
+		if len(rows) > 2:
+			
+			for row in rows[1:]:		
+				# Generate a list for each of the given zip codes
+				info.append(row)
+		
+		# If there's only one zip code, return all the elements of the row
+		else:
+			info.append(rows[1])
+		
+		zip_codes.put(key, info)
+
+		return info
+	
+	# If it's a negative response, returne the message	
+	else:
+		zip_codes.put(key, response, rejection)
+
+		return response
+
+## -------------------- street index --------------------
+
+class Streets():
+	'''Find zip codes in a local copy of the streets of the region.
+
+	The index is built from a CSV file with a header and the columns 
+	UF, Localidade, Logradouro, Bairro, CEP, Inicio, Fim and Lado. 
+	Inicio and Fim are the first and last numbers of the stretch of the 
+	street with that zip code, and may be empty when the zip code is 
+	the same for the whole street, or for the rest of it. Lado is P (or 
+	Par) for the even side, I (or Impar) for the odd side and anything 
+	else for both.
+
+	The whole file is kept in memory, bound to the UF, the city and the 
+	street, so a lookup never leaves the process.
+	'''
+
+	def __init__(self, db):
+		'''Read the CSV file at the given path, if there is one.'''
+
+		self.db = db
+		self.streets = collections.defaultdict(list)
+
+		if not os.path.exists(db):
+			return
+
+		with open(db, 'r', encoding='utf-8-sig', newline='') as f:
+
+			# Both commas and semicolons are found in these files
+			dialect = csv.Sniffer().sniff(f.readline(), ',;')
+			f.seek(0)
+
+			for line in csv.DictReader(f, dialect=dialect):
+
+				key = (
+					line['UF'].strip().upper(),
+					normalize(line['Localidade']),
+					normalize(line['Logradouro'])
+				)
+
+				# Par, Impar or Ambos, in full or as a single letter
+				side = accent(line['Lado']).strip().upper()[:1]
+
+				self.streets[key].append((
+					int(line['Inicio']) if line['Inicio'].strip() else 0,
+					int(line['Fim']) if line['Fim'].strip() else None,
+					side if side in ('P', 'I') else '',
+					[
+						line['Logradouro'].strip(),
+						line['Bairro'].strip(),
+						'{}/{}'.format(line['Localidade'].strip(), key[0]),
+						line['CEP'].strip()
+					]
+				))
+
+	def find(self, data):
+		'''Return the zip codes of an address, as correios() does.
+
+		Args:
+			data: the same list given to correios().
+
+		Returns:
+			A list with the [street, neighborhood, city, zip code] of 
+			every stretch of the street that holds the number, or None 
+			if the street isn't in the index or no stretch holds it.
+		'''
+
+		key = (
+			str(data[3]).strip().upper(),
+			normalize(str(data[2])),
+			normalize(str(data[1]))
+		)
+
+		stretches = self.streets.get(key)
+		if not stretches:
+			return None
+
+		# Without a number, every stretch of the street is a candidate
+		number = re.match(r'\s*(\d+)', str(data[0] or ''))
+
+		if number is None:
+			return [x[3] for x in stretches]
+
+		number = int(number.group(1))
+		side = 'P' if number % 2 == 0 else 'I'
+
+		info = [x[3] for x in stretches
+			if x[0] <= number
+			and (x[1] is None or number <= x[1])
+			and x[2] in ('', side)]
+
+		return info or None
+
+
+streets = {}
+streets_lock = threading.Lock()
+
+
+def street():
+	'''Return the street index, reading it if needed.
+
+	The CSV file is expected in the Database folder, as streets.csv. 
+	Without it the index is empty and every address goes to Correios.
+	'''
+
+	db = path + '\\Database\\streets.csv'
+
+	with streets_lock:
+		if db not in streets:
+			streets[db] = Streets(db)
+
+	return streets[db]
+
+
+def postal(data, offline=False):
+	'''Return the zip codes of an address from the index or Correios.
+
+	Correios is only asked when the street index has no match. The 
+	offline argument is passed to correios().
+	'''
+
+	info = street().find(data)
+
+	if info is not None:
+		metrics.count('street index hits')
+		return info
+
+	with metrics.stage('correios'):
+		return correios(data, offline)
+	
+## -------------------- address analisys --------------------
+
+# Street, number and complement of an address in a single match
+parts = re.compile(r'^(.*?)(\d{1,4})\s*(.*)\Z', re.DOTALL)
+
+
+def addressParser(data):
+	'''Analyze and parse the address, returning street name, number 
+	and complement if present and as separate fields.
+
+	Because some of the addresses have different formating, there is a 
+	necessity to analyze each one and return separate values for street 
+	name,street number and complement.
+
+	Args:
+		data: the original address. May be a string or a list with street 
+			name, street number and complement if they are in separate fields.
+
+	Return:
+		If doesn't have a number column and can't find more than 
+		one item if splitted, will then search for a number and, 
+		if still can't find any number, will return false. It will 
+		return the address itself if can't split the address between 
+		a comma, but only if a number is found. The full form is a list 
+		containig the street address, the number and complement, all as 
+		separate elements that can be used later.
+	'''
+	
+	string = ' '.join([str(x) for x in data]).replace(',', '')
+	
+	# The text before the first number, the number and the rest without 
+	# the whitespace in the beginning
+	found = parts.match(string)
+	
+	if found is None:
+		return False
+
+	street, number, complement = found.groups()
+
+	# Validate the complement
+	return street, number, complement or False
+
+
+def addressParsers(column):
+	'''Parse a whole column of addresses at once.
+
+	Args:
+		column: an iterable with the addresses, each one in any of the 
+			forms accepted by addressParser().
+
+	Returns:
+		A list with the result of each address, in the same order.
+	'''
+	return [addressParser(data) for data in column]
+
+
+# Abbreviations found in the maillings, with the word each one stands for
+abbreviations = {
+	'av': 'avenida',
+	'avda': 'avenida',
+	'r': 'rua',
+	'tv': 'travessa',
+	'trav': 'travessa',
+	'al': 'alameda',
+	'pc': 'praca',
+	'pca': 'praca',
+	'est': 'estrada',
+	'estr': 'estrada',
+	'rod': 'rodovia',
+	'lgo': 'largo',
+	'bc': 'beco',
+	'vl': 'vila',
+	'jd': 'jardim',
+	'dr': 'doutor',
+	'prof': 'professor',
+	'eng': 'engenheiro',
+	'gal': 'general',
+	'gen': 'general',
+	'cel': 'coronel',
+	'cap': 'capitao',
+	'ten': 'tenente',
+	'sen': 'senador',
+	'dep': 'deputado',
+	'pres': 'presidente',
+	'pe': 'padre',
+	'sta': 'santa',
+	'sto': 'santo'
+}
+
+
+def canonical(street, number, city):
+	'''Return a key that is the same for every spelling of an address.
+
+	Accents, case, punctuation and whitespace are ignored and the usual 
+	abbreviations are expanded, so 'Av. Protásio Alves' and 'AVENIDA 
+	PROTASIO ALVES' give the same key.
+	'''
+
+	def words(string):
+		return [abbreviations.get(x, x) for x in 
+			re.findall(r'\w+', normalize(str(string)))]
+
+	return ' '.join(words(street)), str(number).strip(), ' '.join(words(city))
+
+## -------------------- ascii converter --------------------	
+
+def fold(string):
+	'''Remove the combining marks of every character of a string.'''
+	return ''.join(x for x in unicodedata.normalize('NFD', string) if
+		unicodedata.category(x) != 'Mn'
+	)
+
+
+# Precomputed folding of every accented latin character, the ones found 
+# in the addresses, so most strings need a single translate()
+folding = {x: fold(chr(x)) for x in range(0x80, 0x250)
+	if fold(chr(x)) != chr(x)}
+
+
+@functools.lru_cache(maxsize=65536)
+def accent(string):
+	'''Remove any special characters of a string.
+
+	Strings containing special characters can't be passed into a 
+	post request and sometimes can't be printed in the terminal.
+
+	Pure ASCII strings are returned as they are, and the others are 
+	translated with a precomputed table. Only characters outside the 
+	table go through the unicodedata normalization. The names of 
+	streets and cities repeat a lot, so the results are memoized.
+
+	Args:
+		string: a string that may or may not have any special 
+		characters on it.
+
+	Returns:
+		word: the same string containing only ASCII characters.
+	'''
+
+	if string.isascii():
+		return string
+
+	word = string.translate(folding)
+
+	if not word.isascii():
+		word = fold(word)
+
+	return word
+
+
+def accents(column):
+	'''Remove the special characters of a whole column.
+
+	Each distinct value is folded only once. Cells that aren't strings, 
+	like the numbers read by xlrd, are kept as they are.
+
+	Args:
+		column: an iterable with the cells of the column.
+
+	Returns:
+		A list with the folded cells, in the same order.
+	'''
+
+	memo = {}
+	words = []
+
+	for cell in column:
+
+		if type(cell) != str:
+			words.append(cell)
+			continue
+
+		if cell not in memo:
+			memo[cell] = accent(cell)
+
+		words.append(memo[cell])
+
+	return words
+	
+## -------------------- row lookup --------------------
+
+def prepare(row, positions):
+	'''Return the street, number and complement of a row.'''
+
+	delivery = Parser(row[0], positions)
+
+	raw_address = [
+		delivery.address(),
+		delivery.number(),
+		delivery.complement()
+	]
+
+	with metrics.stage('address'):
+		return addressParser(raw_address)
+
+
+def search(formatted_address, city, batch=False, archive=None, offline=False):
+	'''Find the Google data and the zip codes of an address.
+
+	The address is sent to Google and, if Google finds only one address, 
+	its zip code is searched with postal().
+
+	Args:
+		formatted_address: the address as returned by addressParser().
+		city: the city given in the mailling.
+		batch: if True, the zip codes are searched for every address 
+			found by Google, so the choice can be made later without 
+			any new request.
+		archive: passed to google().
+		offline: passed to google() and postal().
+
+	Returns:
+		A tuple with the Google data and the zip codes. If Google found 
+		more than one address the zip codes will be None, because the 
+		user still has to choose one of them, or a list with the zip 
+		codes of each address in batch mode. If the Correios request 
+		fails, they will be False.
+	'''
+
+	address_url = '{}, {} - {}'.format(
+		formatted_address[0],	# Street
+		formatted_address[1],	# Number
+		city					# City (from the document)
+	)
+
+	with metrics.stage('google'):
+		google_data = google(address_url, archive, offline)
+
+	# Negative responses are handled by crawler()
+	if type(google_data) == str:
+		return google_data, None
+
+	if len(google_data[0]) > 1:
+		metrics.count('ambiguous addresses')
+
+	# So are multiple addresses, unless running in batch mode
+	if len(google_data[0]) > 1 and not batch:
+		return google_data, None
+
+	zip_codes = []
+
+	for info in google_data[0]:
+
+		complete(info, formatted_address[1])
+
+		try:
+			zip_codes.append(postal(info, offline))
+		except:
+			metrics.count('correios exceptions')
+			zip_codes.append(False)
+			continue
+
+		if type(zip_codes[-1]) == list and len(zip_codes[-1]) > 1:
+			metrics.count('ambiguous zip codes')
+
+	zip_code = zip_codes if len(zip_codes) > 1 else zip_codes[0]
+
+	return google_data, zip_code
+
+
+def pipeline(rows, positions, workers, **options):
+	'''Look up the rows concurrently and yield them in the original order.
+
+	A thread pool keeps up to twice the number of workers in flight, so 
+	while the user is answering a question about one row the next ones 
+	are already being fetched.
+
+	Rows with the same canonical() address, like several receivers in 
+	the same building, are searched only once. The later ones wait for 
+	the search of the first and get the same Google data and zip codes, 
+	each one with its own complement.
+
+	Args:
+		rows: an iterable with the rows yielded by generator().
+		positions: the list of indices returned by index().
+		workers: the number of searches running at the same time. If 
+			lower than 2, every row is looked up sequentially.
+		options: passed to search().
+
+	Yields:
+		The original row and a tuple with its formatted address, Google 
+		data and zip codes, the last two as given by search(). Bad 
+		addresses have None for both.
+	'''
+
+	import concurrent.futures
+
+	def immediately(function, *args, **kwargs):
+		future = concurrent.futures.Future()
+		future.set_result(function(*args, **kwargs))
+		return future
+
+	def result(row, formatted_address, future):
+		if future is None:
+			return row, (formatted_address, None, None)
+		return row, (formatted_address,) + future.result()
+
+	searches = {}
+	pending = collections.deque()
+
+	with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+
+		if workers >= 2:
+			start, window = executor.submit, workers * 2
+		else:
+			start, window = immediately, 1
+
+		for row in rows:
+
+			formatted_address = prepare(row, positions)
+			future = None
+
+			# Bad addresses aren't sent to Google
+			if formatted_address != False:
+
+				city = Parser(row[0], positions).city()
+				key = canonical(formatted_address[0], formatted_address[1], city)
+
+				metrics.count('searched rows')
+
+				if key not in searches:
+					metrics.count('unique addresses')
+					searches[key] = start(
+						search,
+						formatted_address,
+						city,
+						**options
+					)
+
+				future = searches[key]
+
+			pending.append((row, formatted_address, future))
+
+			# Keep the queue bounded, waiting for the oldest row
+			if len(pending) >= window:
+				yield result(*pending.popleft())
+
+		while pending:
+			yield result(*pending.popleft())
+
+
+def final(delivery, positions, formatted_address, google_data, postal_code):
+	'''Join all the information retrieved for a row into its record.'''
+
+	complement = formatted_address[2]
+	# Format the final address after check if has a complement
+	number = '{} / {}'.format(
+		google_data[0],
+		complement
+	)	if complement != False else google_data[0]
+	
+	# street, number / complement(optional) - city
+	final_address = (google_data[1] + ', ' +
+		number + ' - ' +
+		google_data[2] + '/' +
+		google_data[3]
+	)
+
+	# All the formatted info that was retrieved
+	info = [
+		delivery.name(),
+		final_address,
+		postal_code,
+		delivery.postal(),
+		google_data[2],		# City
+		google_data[3],		# State
+		google_data[4],		# Lat
+		google_data[5],		# Lng
+	]
+	
+	# Check and add the addresse to the final list if it's present 
+	addresse = delivery.addresse()
+	
+	if positions[1] != -1:
+		info.insert(1, addresse)
+	else:
+		pass
+
+	return info
+
+## -------------------- run journal --------------------
+
+class Journal():
+	'''Keep an append-only record of the rows finished by crawler().
+
+	Every finished row is written as a line of JSON as soon as it's 
+	done, so an interrupted run can be resumed without looking up the 
+	same rows again, together with the name of the mailling it came 
+	from. The journal is bound to the name of the mailling, or of the 
+	folder of maillings, and lives in the Database\\Journal folder.
+	'''
+
+	def __init__(self, resume):
+		'''Args:
+			resume: if True, the rows already in the journal are loaded 
+				and skipped. Otherwise the journal starts empty.
+		'''
+
+		self.resume = resume
+		self.done = {}
+		self.name = None
+		self.db = None
+		self.file = None
+
+	def open(self, name):
+		'''Load the finished rows, if resuming, and open the journal.'''
+
+		directory = path + '\\Database\\Journal'
+		self.name = name
+		self.db = r'{}\{}.jsonl'.format(directory, name)
+
+		if self.resume and os.path.exists(self.db):
+
+			with open(self.db, 'r', encoding='utf-8') as f:
+				for line in f:
+					# The last line may be incomplete after a crash
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						continue
+
+					self.done[entry['seq']] = (
+						entry['info'],
+						entry['review'],
+						entry.get('source', name)
+					)
+
+			print('Resuming after {} finished rows.'.format(len(self.done)))
+
+		mode = 'a' if self.resume else 'w'
+		self.file = open(self.db, mode, encoding='utf-8')
+
+	def skip(self, rows):
+		'''Yield the rows that aren't in the journal yet.
+
+		The journal is opened with the name of the first row. The 
+		sequence of each row in the mailling is added to its tuple, 
+		so the rows can be put back in order later.
+		'''
+
+		for seq, row in enumerate(rows):
+
+			if self.file is None:
+				self.open(row[3])
+
+			if seq not in self.done:
+				yield row + (seq,)
+
+	def append(self, seq, info, review, source):
+		'''Record a finished row.'''
+
+		line = json.dumps({
+			'seq': seq,
+			'info': info,
+			'review': review,
+			'source': source
+		}, ensure_ascii=False)
+
+		self.file.write(line + '\n')
+		self.file.flush()
+
+	def close(self, remove=False):
+		'''Close the journal, removing it if the run was saved.'''
+
+		if self.file is None:
+			return
+
+		self.file.close()
+
+		if remove:
+			os.remove(self.db)
+
+## -------------------- web crawler --------------------
+
+def crawler(workers=workers, batch=False, resume=False, offline=False, 
+	folder=None, positions=None, mailling=None):
+	'''Find the zip code and geodata of every address in a mailling.
+
+	Args:
+		workers: the number of rows looked up at the same time.
+		batch: if True, the user is never asked to choose between 
+			addresses or zip codes. Those rows are saved with a 
+			placeholder and written, with all their candidates, to a 
+			review file in the Database\\Review folder, to be applied 
+			later by resolve().
+		resume: if True, the rows finished by an interrupted run of the 
+			same mailling are taken from its journal instead of being 
+			looked up again.
+		offline: if True, Google and Correios are never requested and 
+			the addresses are only taken from the caches, the one 
+			rebuilt by replay() first. Rows not found there are saved 
+			as NOT_ARCHIVED, and no archive is opened.
+		folder: if given, every mailling in this folder (or matching 
+			this pattern) inside Spreadsheets\\Mailling is read at 
+			once by workbooks(), instead of asking for a single one. 
+			All of them must have the same columns. The records of 
+			each mailling are still saved with its own name.
+		positions: the indices of the columns, as returned by index(). 
+			If not given, the user is asked for them.
+		mailling: the path of the mailling. If not given, the user is 
+			asked to choose one.
+	'''
+
+	# Generate a list of indexes
+	if positions is None:
+		positions = index()
+	
+	# All the information will be stored here, bound to the sequence 
+	# of the row, together with its review entry if it has one and the 
+	# name of its mailling
+	journal = Journal(resume)
+	records = journal.done
+
+	def finish(info, entry=None):
+		records[row[4]] = info, entry, row[3]
+		journal.append(row[4], info, entry, row[3])
+
+	# The cache counters only report the current run
+	for table in caches:
+		caches[table].hits = caches[table].misses = 0
+	pool.reset()
+	metrics.reset()
+
+	message = 'Choose the original mailling:'
+	directory = '\\Mailling'
+	columns = [x for x in positions if x != -1]
+
+	if folder is None:
+		rows = generator(directory, message, columns, mailling)
+	else:
+		if folder:
+			directory += '\\' + folder.strip('\\')
+
+		# The journal of a folder is named after it
+		journal.open(' '.join(['Batch'] + re.findall(r'[\w-]+', directory)))
+		rows = workbooks(directory, columns)
+
+	rows = journal.skip(rows)
+
+	# The responses of this run are kept in a single archive, unless 
+	# there won't be any
+	stamp = time.strftime('%Y-%m-%d %H-%M-%S')
+	archive = Archive(stamp) if not offline else None
+
+	# The choices of the user for each canonical() address, so the rest 
+	# of the rows at that address aren't asked again
+	addresses = {}
+	numbers = {}
+
+	try:
+		for row, result in pipeline(
+			rows,
+			positions,
+			workers,
+			batch=batch,
+			archive=archive,
+			offline=offline
+		):
+
+			metrics.count('rows')
+
+			try:
+				print('\n{}/{} ({})\n{}'.format(
+					row[1],		# Current address
+					row[2],		# Total addresses 
+					metrics.progress(row[1], row[2]),
+					row[0]		# Data
+				))
+			except UnicodeEncodeError:
+				print('\n{}/{} ({})\n{}'.format(
+					row[1],		# Current address
+					row[2],		# Total addresses 
+					metrics.progress(row[1], row[2]),
+					'Can\'t decode special character.'		# Data
+				))
+			
+			# Any information regarding the original data will be fetched 
+			# by calling this object.	
+			delivery = Parser(row[0], positions)
+		
+			formatted_address, google_data, zip_code = result
+
+			# Check if it was a valid address before being sent to Google
+			if formatted_address == False:
+				# This block of code will execute if it's a bad address
+				message = 'Address has no complement.'
+				print(message)
+				row[0].append(message)
+				finish(row[0])
+				continue
+
+			if type(google_data) == str:
+				print(google_data)
+				row[0].append(google_data)
+				finish(row[0])
+				continue
+
+			print('Response:', google_data[1])
+
+			# Ambiguous rows are left for the review file in batch mode
+			if batch and (len(google_data[0]) > 1 or 
+					type(zip_code) == list and len(zip_code) > 1):
+
+				if len(google_data[0]) == 1:
+					zip_code = [zip_code]
+
+				entry = {
+					'row': row[0],
+					'positions': positions,
+					'address': formatted_address,
+					'candidates': [{
+						'google': address,
+						'zip': number
+					} for address, number in zip(google_data[0], zip_code)],
+					'choice': None
+				}
+
+				message = waiting
+				print(message)
+				finish(row[0] + [message], entry)
+				continue
+
+			key = canonical(
+				formatted_address[0],
+				formatted_address[1],
+				delivery.city()
+			)
+
+			if len(google_data[0]) > 1 and key in addresses:
+				google_data, zip_code = addresses[key]
+
+			elif len(google_data[0]) > 1:
+				for i, address in enumerate(google_data[0]):
+					print('{}. {} - {} / {}'.format(
+						i,
+						address[1],
+						address[2],
+						address[3]
+					))
+				msg = 'Google found more than one address. Choose one: '
+				user_address = input(msg)
+				google_data = google_data[0][int(user_address)]
+
+				complete(google_data, formatted_address[1])
+
+				# Search for the postal code in the Correios web page
+				try:
+					zip_code = postal(google_data, offline)
+				except:
+					metrics.count('correios exceptions')
+					continue
+
+				addresses[key] = google_data, zip_code
+
+			else:
+				google_data = google_data[0][0]
+
+			# The Correios request failed inside search()
+			if zip_code == False:
+				continue
+
+			# If the Zip Code insn't a list, it menas it's a bad address
+			if type(zip_code) == str:
+				print(zip_code, '\n')
+				row[0].append(zip_code)		
+				finish(row[0])
+				continue
+
+			# If the address return more than one ZIP Code, ask the user 
+			# to choose the correct one 
+			elif key in numbers:
+				postal_code = numbers[key]
+
+			elif len(zip_code) > 1:
+
+				for i, number in enumerate(zip_code):
+					try:
+						print('{}. {} - {} - {} {}'.format(
+							i,
+							number[0],		# Street
+							number[1],		# Neighborhood
+							number[2],		# City
+							number[3]		# ZIP Code
+						))
+					except UnicodeEncodeError:
+						pass
+				
+				pick = input('Choose a Zip Code: ')
+				postal_code = zip_code[int(pick)][3]
+				numbers[key] = postal_code
+		
+			else:
+				postal_code = zip_code[0][3]
+
+			print('Postal Code: {}'.format(postal_code))
+
+			info = final(
+				delivery,
+				positions,
+				formatted_address,
+				google_data,
+				postal_code
+			)
+		
+			finish(info)
+
+	finally:
+		journal.close()
+		if archive is not None:
+			archive.close()
+		for table in caches:
+			caches[table].flush()
+
+	# Put the rows back in the order of each mailling
+	sources = {}
+
+	for seq in sorted(records):
+
+		info, entry, source = records[seq]
+		data, review = sources.setdefault(source, ([], []))
+
+		if entry is not None:
+			entry['position'] = len(data)
+			review.append(entry)
+
+		data.append(info)
+
+	with metrics.stage('save'):
+		for name, (data, review) in sources.items():
+			save(data, '\\GeoInfo', name)
+
+	# The run is complete, there is nothing left to resume
+	journal.close(remove=True)
+
+	for name, (data, review) in sources.items():
+		if review:
+			write(review, name)
+
+	# Show how many requests were saved by the caches
+	for table in caches:
+		print(caches[table].report())
+
+	# And how long the ones left took on each host
+	if pool.latency:
+		print(pool.report())
+
+	if metrics.counters['duplicate rows']:
+		print('{} repeated rows left out.'.format(
+			metrics.counters['duplicate rows']
+		))
+
+	# Rows at the same address were searched only once
+	searched = metrics.counters['searched rows']
+	if searched:
+		unique = metrics.counters['unique addresses']
+		print('{} rows searched as {} unique addresses ({:.1f}% saved)'.format(
+			searched,
+			unique,
+			(1 - unique / searched) * 100
+		))
+
+	# The metrics share the name of the archive of the run
+	print('Metrics saved at: {}'.format(metrics.dump(stamp)))
+
+## -------------------- review ambiguous rows --------------------
+
+def write(review, name):
+	'''Write the rows waiting for a choice to a JSON review file.
+
+	Each entry holds the original row and every candidate found, each 
+	one with the address given by Google and the zip codes given by 
+	Correios for it. To choose, the 'choice' of the entry must be set 
+	to a list with the index of the address and of the zip code, like 
+	[1, 0]. Entries left as null are kept for a later review.
+	'''
+
+	directory = path + '\\Database\\Review'
+	db = r'{}\{}.json'.format(directory, name)
+
+	with open(db, 'w', encoding='utf-8') as f:
+		json.dump(review, f, ensure_ascii=False, indent=1)
+
+	print('{} rows waiting for review. Saved at: {}'.format(
+		len(review),
+		db
+	))
+
+
+def resolve():
+	'''Apply the choices of a review file to its GeoInfo database.
+
+	Every information needed was saved by crawler(), so no request is 
+	made, and only the chosen records are changed in the database. 
+	Entries without a valid choice stay in the review file.
+	'''
+
+	message = 'Choose the review file:'
+	directory = path + '\\Database\\Review'
+	archive = load(directory, 'json', message)
+
+	with open(archive[0], 'r', encoding='utf-8') as f:
+		review = json.load(f)
+
+	pending, changes = [], []
+
+	for entry in review:
+
+		choice = entry['choice']
+
+		if choice is None:
+			pending.append(entry)
+			continue
+
+		candidate = entry['candidates'][choice[0]]
+		zip_code = candidate['zip']
+
+		# The Correios request failed while crawling
+		if zip_code == False:
+			pending.append(entry)
+			continue
+
+		row = entry['row']
+
+		# A bad address, the message is kept as in crawler()
+		if type(zip_code) == str:
+			changes.append((entry['position'], row + [zip_code]))
+			continue
+
+		info = final(
+			Parser(row, entry['positions']),
+			entry['positions'],
+			entry['address'],
+			candidate['google'],
+			zip_code[choice[1]][3]
+		)
+
+		changes.append((entry['position'], info))
+
+	storage().update('\\GeoInfo', archive[1], changes)
+
+	print('{} records changed.'.format(len(changes)))
+
+	if pending:
+		write(pending, archive[1])
+	else:
+		os.remove(archive[0])
+
+## -------------------- storage engine --------------------
+
+# Where the receiver, the label number and the zip code are found in 
+# the records of each database, or None if the record doesn't have it
+fields = {
+	'\\GeoInfo': (0, None, -6),
+	'\\Labels': (1, 0, -6),
+	'\\History': (1, 0, -7),
+	'\\Routes': (0, None, -6)
+}
+
+# How many fields each database adds before and after the record made 
+# by final(), the label number and the delivery status
+shapes = {
+	'\\GeoInfo': (0, 0),
+	'\\Labels': (1, 0),
+	'\\History': (1, 1),
+	'\\Routes': (0, 0)
+}
+
+# The placeholder of the rows left for the review file in batch mode
+waiting = 'Waiting for review.'
+
+
+def located(folder, item):
+	'''Return True if the record holds an address that was found.
+
+	Bad addresses and rows waiting for review are saved as the original 
+	row followed by a message, so their width depends on the mailling. 
+	Only the records made by final() have eight or nine fields, the 
+	last two being the position.
+	'''
+
+	before, after = shapes[folder]
+	info = item[before:len(item) - after]
+
+	if len(info) not in (8, 9):
+		return False
+
+	try:
+		float(info[-2])
+		float(info[-1])
+	except (TypeError, ValueError):
+		return False
+
+	return True
+
+
+class Storage():
+	'''Keep the GeoInfo, Labels and History databases in SQLite.
+
+	Each record is stored pickled in its own row, together with its 
+	position in the database and with indexed columns for its receiver, 
+	label number and zip code. That way a database can be read in 
+	chunks, searched by any of those keys and changed in place, without 
+	loading the whole list as the pickle files needed.
+	'''
+
+	def __init__(self, db):
+		'''Open (or create) the SQLite file at the given path.'''
+
+		self.db = db
+
+		# The same connection is shared by every thread, and copy() 
+		# reads while it writes
+		self.lock = threading.RLock()
+		self.connection = sqlite3.connect(db, check_same_thread=False)
+
+		with self.connection:
+			self.connection.execute(
+				'CREATE TABLE IF NOT EXISTS records ('
+				'folder TEXT, name TEXT, position INTEGER, '
+				'receiver TEXT, label TEXT, zip TEXT, data BLOB, '
+				'PRIMARY KEY (folder, name, position))'
+			)
+			for column in ('receiver', 'label', 'zip'):
+				self.connection.execute(
+					'CREATE INDEX IF NOT EXISTS records_{0} '
+					'ON records (folder, name, {0})'.format(column)
+				)
+
+	def keys(self, folder, item):
+		'''Return the receiver, label number and zip code of a record.'''
+
+		keys = []
+
+		for i in fields[folder]:
+			try:
+				keys.append(receiver(item[i]) if i is not None else None)
+			except IndexError:
+				keys.append(None)
+
+		# Bad addresses don't have a zip code, whatever is in that position
+		zip_code = r'^\d{5}-?\d{3}$'
+		if keys[2] is not None and (not located(folder, item) or 
+				not re.search(zip_code, keys[2])):
+			keys[2] = None
+
+		return keys
+
+	def write(self, folder, name, data):
+		'''Replace a whole database with the given records.'''
+
+		rows = ((
+			folder,
+			name,
+			i,
+			*self.keys(folder, item),
+			pickle.dumps(item)
+		) for i, item in enumerate(data))
+
+		with self.lock, self.connection:
+			self.connection.execute(
+				'DELETE FROM records WHERE folder = ? AND name = ?',
+				(folder, name)
+			)
+			self.connection.executemany(
+				'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)',
+				rows
+			)
+
+	def read(self, folder, name, size=1000):
+		'''Yield the records of a database in chunks, in their order.
+
+		Args:
+			folder: the kind of database, as given to save().
+			name: the name of the database.
+			size: the number of records in each chunk.
+
+		Yields:
+			A list with up to size records.
+		'''
+
+		last = -1
+
+		while True:
+
+			# Each chunk is a separate query, so the database can be 
+			# changed between chunks
+			with self.lock:
+				rows = self.connection.execute(
+					'SELECT position, data FROM records '
+					'WHERE folder = ? AND name = ? AND position > ? '
+					'ORDER BY position LIMIT ?',
+					(folder, name, last, size)
+				).fetchall()
+
+			if not rows:
+				return
+
+			last = rows[-1][0]
+
+			yield [pickle.loads(x[1]) for x in rows]
+
+	def find(self, folder, name, field, value):
+		'''Return the position and record of every match of an index.
+
+		Args:
+			folder: the kind of database, as given to save().
+			name: the name of the database.
+			field: 'receiver', 'label' or 'zip'.
+			value: the value searched. Receivers and labels are 
+				normalized the same way as when they were stored.
+
+		Returns:
+			A list of (position, record) tuples.
+		'''
+
+		if field != 'zip':
+			value = receiver(value)
+
+		with self.lock:
+			rows = self.connection.execute(
+				'SELECT position, data FROM records '
+				'WHERE folder = ? AND name = ? AND {} = ? '
+				'ORDER BY position'.format(field),
+				(folder, name, value)
+			).fetchall()
+
+		return [(x[0], pickle.loads(x[1])) for x in rows]
+
+	def repeated(self, folder, name, field):
+		'''Return the values of an index shared by more than one record.'''
+
+		with self.lock:
+			rows = self.connection.execute(
+				'SELECT {0} FROM records '
+				'WHERE folder = ? AND name = ? AND {0} IS NOT NULL '
+				'GROUP BY {0} HAVING COUNT(*) > 1'.format(field),
+				(folder, name)
+			).fetchall()
+
+		return [x[0] for x in rows]
+
+	def update(self, folder, name, changes):
+		'''Replace some records of a database in place.
+
+		Args:
+			folder: the kind of database, as given to save().
+			name: the name of the database.
+			changes: an iterable of (position, record) tuples.
+		'''
+
+		rows = ((
+			*self.keys(folder, item),
+			pickle.dumps(item),
+			folder,
+			name,
+			i
+		) for i, item in changes)
+
+		with self.lock, self.connection:
+			self.connection.executemany(
+				'UPDATE records SET receiver = ?, label = ?, zip = ?, '
+				'data = ? WHERE folder = ? AND name = ? AND position = ?',
+				rows
+			)
+
+	def copy(self, source, folder, name):
+		'''Copy a database into another folder, updating its indexes.'''
+		self.write(folder, name, (
+			item for chunk in self.read(source, name) for item in chunk
+		))
+
+	def names(self, folder):
+		'''Return the names of every database of a folder.'''
+
+		with self.lock:
+			rows = self.connection.execute(
+				'SELECT DISTINCT name FROM records WHERE folder = ? '
+				'ORDER BY name',
+				(folder,)
+			).fetchall()
+
+		return [x[0] for x in rows]
+
+
+# Every storage already opened, bound by the path of its file
+storages = {}
+storages_lock = threading.Lock()
 
-		# Check if it's a valid address before sending to Google		
-		if formatted_address == False:
-			# This block of code will execute if it's a bad address
-			message = 'Address has no complement.'
-			print(message)
-			row[0].append(message)
-			data.append(row[0])			
-			continue
-			
-		else:
-			# Send a formatted address to Google
-			address_url = '{}, {} - {}'.format(
-				formatted_address[0],	# Street
-				formatted_address[1],	# Number
-				delivery.city()			# City (from the document)
-			)
-		
-		google_data = google(address_url)
 
-		if type(google_data) == str:
-			print(google_data)
-			row[0].append(google_data)
-			data.append(row[0])
-			continue
+def storage():
+	'''Return the storage engine, opening it if needed.
 
-		print('Response:', google_data[1])
-		if len(google_data[0]) > 1:
-			for i, address in enumerate(google_data[0]):
-				print('{}. {} - {} / {}'.format(
-					i,
-					address[1],
-					address[2],
-					address[3]
-				))
-			msg = 'Google found more than one address. Choose one: '
-			user_address = input(msg)
-			google_data = google_data[0][int(user_address)]
-		else:
-			google_data = google_data[0][0]
+	The databases are kept in a single file, inside the Database folder.
+	'''
 
-		if len(google_data) < 6:
-			google_data.insert(
-				0,
-				formatted_address[1]
-			)
-		
-		# Search for the postal code in the Correios web page
-		try:
-			zip_code = correios(google_data)
-		except:
-			continue
+	db = path + '\\Database\\storage.db'
 
-		# If the Zip Code insn't a list, it menas it's a bad address
-		if type(zip_code) == str:
-			print(zip_code, '\n')
-			row[0].append(zip_code)		
-			data.append(row[0])
-			continue
+	with storages_lock:
+		if db not in storages:
+			storages[db] = Storage(db)
 
-		# If the address return more than one ZIP Code, ask the user 
-		# to choose the correct one 
-		elif len(zip_code) > 1:
+	return storages[db]
 
-			for i, number in enumerate(zip_code):
-				try:
-					print('{}. {} - {} - {} {}'.format(
-						i,
-						number[0],		# Street
-						number[1],		# Neighborhood
-						number[2],		# City
-						number[3]		# ZIP Code
-					))
-				except UnicodeEncodeError:
-					pass
-				
-			pick = input('Choose a Zip Code: ')
-			postal_code = zip_code[int(pick)][3]
-		
-		else:
-			postal_code = zip_code[0][3]
-
-		complement = formatted_address[2]
-		# Format the final address after check if has a complement
-		number = '{} / {}'.format(
-			google_data[0],
-			complement
-		)	if complement != False else google_data[0]
-		
-		# street, number / complement(optional) - city
-		final_address = (google_data[1] + ', ' +
-			number + ' - ' +
-			google_data[2] + '/' +
-			google_data[3]
-		)
+## -------------------- offline replay --------------------
 
-		print('Postal Code: {}'.format(postal_code))
+def reparse(item):
+	'''Parse an archived response inside a worker process.'''
 
-		# All the formatted info that was retrieved
-		info = [
-			delivery.name(),
-			final_address,
-			postal_code,
-			delivery.postal(),
-			google_data[2],		# City
-			google_data[3],		# State
-			google_data[4],		# Lat
-			google_data[5],		# Lng
-		]
-		
-		# Check and add the addresse to the final list if it's present 
-		addresse = delivery.addresse()
-		
-		if positions[1] != -1:
-			info.insert(1, addresse)
-		else:
-			pass
-		
-		data.append(info)
-		
-		time.sleep(2)
+	import xml.etree.ElementTree
+
+	address, req = item
+
+	try:
+		return address, parse(req)
+	except (xml.etree.ElementTree.ParseError, ValueError):
+		return address, None
+
+
+def responses():
+	'''Yield every response kept in the Logs folder, oldest first.
+
+	The old log files, one XML per address, come first, followed by the 
+	archives of each run in the order they were made.
+	'''
+
+	directory = path + '\\Logs'
+	listing = sorted(os.listdir(directory))
+
+	for item in listing:
+		if re.search(r'\.xml$', item):
+			with open(r'{}\{}'.format(directory, item), 'r') as f:
+				yield re.split(r'\.xml$', item)[0], f.read()
+
+	for item in listing:
+		if re.search(r'\.log$', item):
+			yield from archived(r'{}\{}'.format(directory, item))
+
+
+def replay(processes=None):
+	'''Rebuild the replay cache from the archived responses.
+
+	Every response in the Logs folder is parsed again by parse(), in a 
+	pool of processes, and put in a cache table of its own, which never 
+	expires nor drops entries, so the whole archive fits in it. No 
+	request is made, so after changing the parsing logic the GeoInfo 
+	databases can be rebuilt by running crawler() offline, which reads 
+	that table before the geocode cache.
+
+	Args:
+		processes: the number of worker processes, by default one for 
+			each CPU.
+	'''
 
-	save(data, '\\GeoInfo', name)
+	import concurrent.futures
 
-## -------------------- save binary file --------------------
+	count, broken = 0, 0
+	items = responses()
+	replayed = cache('replay', math.inf, None)
+
+	with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+
+		while True:
+
+			# The responses are sent in blocks, so they're never all 
+			# in memory at once
+			block = list(itertools.islice(items, 10000))
+
+			if not block:
+				break
+
+			entries = []
+
+			for address, data in executor.map(reparse, block, chunksize=64):
+
+				if data is None:
+					broken += 1
+					continue
+
+				if answered(data):
+					entries.append((normalize(address), data))
+				count += 1
+
+			# Newer responses replace the older ones in the cache, and 
+			# each block is written in a single transaction
+			replayed.put_many(entries)
+
+	print('{} responses replayed, {} could not be parsed.'.format(
+		count,
+		broken
+	))
+
+## -------------------- save database --------------------
 
 def save(data, folder, name):
-	'''Pickle the passed data to a file.
+	'''Store the passed data as a database.
 
 	To increase the general workflow of the script, 
-	a binary file will hold the information if needed.'''
-	
-	directory = path + '\\Database' + folder
-	db = r'{}\{}.pickle'.format(directory, name)
+	the storage engine will hold the information if needed.'''
 	
-	with open(db, 'wb') as f:
-		pickle.dump(data, f)
+	storage().write(folder, name, data)
 		
-	print('Data succefully generated! Saved at:', db)
+	stored(folder, name)
+
+
+def stored(folder, name):
+	'''Tell the user where a database was saved.'''
+	print('Data succefully generated! Saved at: {} ({}\\{})'.format(
+		storage().db,
+		folder,
+		name
+	))
+
+
+def records(folder, name):
+	'''Yield every record of a database, in order.'''
+	for chunk in storage().read(folder, name):
+		yield from chunk
+
+
+def database(folder, message):
+	'''List the databases of a folder and return the chosen name.'''
+
+	listing = storage().names(folder)
+
+	print('\n{}'.format(message))
+
+	for i, item in enumerate(listing):
+		print('{}. {}'.format(i, item))
+
+	pick = input()
+
+	return listing[int(pick)]
 	
 ## -------------------- open binary file --------------------
 
@@ -660,6 +2778,42 @@ def launch(path):
 
 	return data
 
+
+def migrate():
+	'''Copy the old pickle databases into the storage engine.
+
+	Every .pickle file in the GeoInfo, Labels and History folders is 
+	stored with its file name, unless a database with that name is 
+	already there. It only needs to run once.
+	'''
+
+	count = 0
+
+	for folder in fields:
+
+		directory = path + '\\Database' + folder
+
+		# Only the oldest folders had pickle files
+		if not os.path.isdir(directory):
+			continue
+
+		stored = storage().names(folder)
+
+		for item in os.listdir(directory):
+
+			name = re.split(r'\.\w+$', item)[0]
+
+			if not re.search(r'\.pickle$', item) or name in stored:
+				continue
+
+			data = launch(r'{}\{}'.format(directory, item))
+			storage().write(folder, name, data)
+
+			print('{}\\{}: {} records'.format(folder, name, len(data)))
+			count += 1
+
+	print('{} databases migrated.'.format(count))
+
 ## -------------------- print directory --------------------
 
 def load(path, extension, message):
@@ -683,184 +2837,611 @@ def load(path, extension, message):
 	
 ## -------------------- sort zip-codes --------------------
 
-def sort():
-	'''Simply puts the data into a spreadsheet.'''
-	#workbook = xlwt.workbook(encoding='utf-8')
-	#sheet = workbook.add_sheet
-
-	def comparison(number, code):
-		return number[:len(code)] == code
-
-	data = load()
-
-	names = [
-		'CDA Cristal',
-		'CDA Farrapos',
-		'CDA Farroupilha',
-		'CDA Iguatemi',
-		'CDA Jardim Botânico',
-		'CDA Menino Deus',
-		'CDA Teresópolis',
-		'CDB Protásio Alves'
-	]
-	codes = [
-		[908, 919],
-		[902, 910, 911, 912],
-		[9003, 9004],
-		[913, 914, 915],
-		[9001, 9002, 906],
-		[901],
-		[917],
-		[904, 905]
-	]
+# The zip code prefixes delivered by each distribution center
+centers = {
+	'CDA Cristal': ['908', '919'],
+	'CDA Farrapos': ['902', '910', '911', '912'],
+	'CDA Farroupilha': ['9003', '9004'],
+	'CDA Iguatemi': ['913', '914', '915'],
+	'CDA Jardim Botânico': ['9001', '9002', '906'],
+	'CDA Menino Deus': ['901'],
+	'CDA Teresópolis': ['917'],
+	'CDB Protásio Alves': ['904', '905']
+}
+
+
+class Router():
+	'''Assign zip codes to distribution centers by their prefixes.
+
+	The prefixes are kept in a trie, one level per digit, so a zip code 
+	is routed by walking its digits once, whatever the number of 
+	centers. The longest prefix found wins. A prefix given to more than 
+	one center, or lying inside the prefix of another center, is kept 
+	in the conflicts list.
+	'''
 
-	agents = dict(zip(names, codes))
-	info = []
+	def __init__(self, table):
+		'''Build the trie from a dict of center names to prefixes.'''
 
-	for item in data:
+		self.trie = {}
+		self.conflicts = []
 
-		# Add bad addresses to the begining
-		if item[-1] == False:
-			info.insert(0, item)
-			continue
+		for center, prefixes in table.items():
+			for prefix in prefixes:
+				self.add(str(prefix), center)
 
-		item_zip = item[-6]
+		# Only now every prefix is known, so the nested ones can be found
+		self.nested(self.trie, '', None)
 
-		for agent in agents:
+	def add(self, prefix, center):
+		'''Insert a prefix, keeping the first center given to it.'''
 
-			# Test for equalty
-			test = [comparison(
-				str(item_zip),
-				str(code)
-			) for code in agents[agent]]
-		
-			if True in test:
-				print('{} => {}'.format(
-					agents[agent], item[-6]
-				))
-			else:
-				pass
+		node = self.trie
+		for digit in prefix:
+			node = node.setdefault(digit, {})
+
+		if None in node:
+			self.conflicts.append((prefix, node[None], prefix, center))
+		else:
+			node[None] = center
+
+	def nested(self, node, prefix, outer):
+		'''Record the prefixes inside a prefix of another center.'''
+
+		if None in node:
+			if outer is not None and outer[1] != node[None]:
+				self.conflicts.append((outer[0], outer[1], prefix, node[None]))
+			outer = prefix, node[None]
+
+		for digit, child in node.items():
+			if digit is not None:
+				self.nested(child, prefix + digit, outer)
+
+	def route(self, zip_code):
+		'''Return the center of a zip code, or None if it has none.'''
+
+		node = self.trie
+		center = None
+
+		for digit in zip_code:
+			if digit == '-':
+				continue
+
+			node = node.get(digit)
+			if node is None:
+				break
+
+			center = node.get(None, center)
+
+		return center
+
+
+def sort(name=None):
+	'''Split a GeoInfo database by the center that delivers each record.
+
+	Every record is routed by its zip code in a single pass and each 
+	center gets its own database in the Routes folder, named after the 
+	original one. Bad addresses, rows waiting for review and zip codes 
+	outside every prefix have a database of their own too.
+	'''
+
+	router = Router(centers)
+
+	for outer, first, inner, second in router.conflicts:
+		print('Conflict: {} ({}) and {} ({})'.format(
+			outer,
+			first,
+			inner,
+			second
+		))
+
+	message = 'Choose the database:'
+	if name is None:
+		name = database('\\GeoInfo', message)
+
+	buckets = collections.defaultdict(list)
+
+	for item in records('\\GeoInfo', name):
+
+		zip_code = storage().keys('\\GeoInfo', item)[2]
+
+		if item[-1] == waiting:
+			center = 'Waiting for review'
+		elif zip_code is None:
+			center = 'Bad addresses'
+		else:
+			center = router.route(zip_code) or 'No center'
+
+		buckets[center].append(item)
+
+	for center, data in sorted(buckets.items()):
+		storage().write('\\Routes', '{} - {}'.format(name, center), data)
+		print('{}: {} records'.format(center, len(data)))
+
+	stored('\\Routes', name + ' - *')
+
+
+def receiver(value):
+	'''Return a key that is the same for every form of a receiver.
 
+	xlrd gives numeric cells as floats, so the same receiver may come 
+	as 1234.0 in one spreadsheet and as '1234' in another. Whitespace 
+	and case are also ignored.
+	'''
+
+	if type(value) == float and value.is_integer():
+		value = int(value)
 
-def compare(item, base):
-		return item == base
+	return ' '.join(str(value).split()).casefold()
 		
 ## -------------------- match labels-addresses --------------------
 		
-def match():
+def match(name=None, labels=None):
+	'''Bind the number of each label to its address.
+
+	The GeoInfo database is copied to Labels and every label is matched 
+	with a single lookup in the receiver index, changing the record in 
+	place. Labels without an address, and receivers found more than 
+	once, are reported at the end.
+
+	Args:
+		name: the GeoInfo database. If not given, the user is asked.
+		labels: the path of the spreadsheet with the labels. If not 
+			given, the user is asked.
+	'''
 
 	message = [
 		'Choose the database:',
 		'Choose the spreadsheet with the labels:'
 	]
-	db = path + '\\Database\\GeoInfo'
-	archive = load(db, 'pickle', message[0])
-	data = launch(archive[0])
+	if name is None:
+		name = database('\\GeoInfo', message[0])
+	storage().copy('\\GeoInfo', '\\Labels', name)
 
-	labels = generator('\\Labels', message[1])
+	# Only the label number and the receiver are needed
+	labels = generator('\\Labels', message[1], [1, 2], labels)
+
+	unmatched, duplicated, matched, changes = [], [], set(), []
 
 	for x in labels:
-		#data[0]
-		#labels[0][2]
-		for i, y in enumerate(data):
-			check = compare(str(y[0]), x[0][2])
-			data[i] = [int(x[0][1])] + y if check else data[i]
+
+		key = receiver(x[0][2])
+		found = storage().find('\\GeoInfo', name, 'receiver', key)
+
+		if not found:
+			unmatched.append(x[0][2])
+			continue
+
+		# A second label for the same receiver would be bound twice
+		if key in matched:
+			duplicated.append(x[0][2])
+			continue
+
+		matched.add(key)
+
+		for i, y in found:
+			changes.append((i, [int(x[0][1])] + y))
 	
-	save(data, '\\Labels', archive[1])
+	storage().update('\\Labels', name, changes)
+	stored('\\Labels', name)
 
-	#return data
+	# Receivers with more than one address got the same label
+	repeated = storage().repeated('\\GeoInfo', name, 'receiver')
+
+	for title, items in (
+		('Labels without an address', unmatched),
+		('Receivers with more than one label', duplicated),
+		('Receivers with more than one address', repeated)
+	):
+		print('{}: {}'.format(title, len(items)))
+		for item in items:
+			print('    {}'.format(item))
 	
 ## -------------------- match delivery status --------------------
 	
-def events():
+def events(name=None, histories=None):
+	'''Bind the latest delivery status to each label.
+
+	Any number of history spreadsheets can be chosen. Their rows are 
+	read as a stream and only the last status found for each label is 
+	kept, so a spreadsheet chosen later overrides the previous ones. 
+	Then the records of each label are found through the label index 
+	and changed in place.
+
+	Args:
+		name: the Labels database. If not given, the user is asked.
+		histories: the paths of the history spreadsheets, in order. If 
+			not given, the user is asked for each one.
+	'''
 
 	message = [
 		'Choose the database:',
-		'Choose the spreadsheet with the delivery history:'
+		'Choose the spreadsheet with the delivery history:',
+		'Add another spreadsheet? (y/n)'
 	]
-	db = path + '\\Database\\Labels'
-	archive = load(db, 'pickle', message[0])
-	
-	data = launch(archive[0])
+	if name is None:
+		name = database('\\Labels', message[0])
+	storage().copy('\\Labels', '\\History', name)
+
+	# Latest status of each label number
+	status = {}
+	pending = list(histories or [])
+
+	while True:
+
+		archive = pending.pop(0) if pending else None
+
+		# Only the label number and the status are needed
+		for x in generator('\\History', message[1], [0, 8], archive):
+			status[receiver(x[0][0])] = x[0][8]
 
-	status = [x for x in generator('\\History', message[1])]
+		if histories:
+			if not pending:
+				break
+		elif input(message[2] + '\n').strip().lower() != 'y':
+			break
 	
-	for x in status:
-		for i, y in enumerate(data):
-			data[i] = y + [x[0][8]] if x[0][0] == str(y[0]) else data[i]
+	changes = []
+
+	for key in status:
+		for i, y in storage().find('\\History', name, 'label', key):
+			changes.append((i, y + [status[key]]))
 			
-	save(data, '\\History', archive[1])
+	storage().update('\\History', name, changes)
+	stored('\\History', name)
 	
 ## -------------------- html/js generator --------------------
 
-def html():
+def render(db, name):
+	'''Write the page with the markers of every record at once.
 
-	message = 'Choose the database:'
-	directory = path + '\\Database\\History'
-	archive = load(directory, 'pickle', message)
-	
-	db = launch(archive[0])
-	
-	web = '\\Markers\\Generated' + '\\{}.html'.format(archive[1])
+	The source page is read a single time, all the records are 
+	serialized as JSON into the 'var locations' array and the 
+	generated page is written a single time.
 
-	for i, item in enumerate(db):
-	
-		source = path + '\\Markers\\source.html' if i == 0 else path + web
-		 
-		f =  open(source, 'r', encoding='utf-8')
+	Args:
+		db: an iterable with the records of a database.
+		name: the name of the generated page, without the extension.
+
+	Returns:
+		The path of the generated page.
+	'''
+
+	source = path + '\\Markers\\source.html'
+	web = path + '\\Markers\\Generated' + '\\{}.html'.format(name)
+
+	with open(source, 'r', encoding='utf-8') as f:
 		data = f.readlines()
-		f.close()
-	
-		pattern = r'var locations'
 
-		index = [data.index(x) for x in data if re.search(pattern, x)]
-		
-		info = ['    ', item, ',\n']
-		
-		new = data[:index[0]+1] + info + data[index[0]+1:]
-		
-		markers = open(path + web, 'w', encoding='utf-8')
-		
-		for x in new:
-			markers.write(str(x))
-		markers.close()
-		
-	print('File succefully generated!')
+	pattern = r'var locations'
+
+	index = [i for i, x in enumerate(data) if re.search(pattern, x)]
+
+	# One array element per line
+	info = ['    {},\n'.format(json.dumps(item, ensure_ascii=False))
+		for item in db]
+
+	new = data[:index[0]+1] + info + data[index[0]+1:]
+
+	with open(web, 'w', encoding='utf-8') as markers:
+		markers.writelines(new)
+
+	return web
+
 
-def htmlFromGeoInfo():
+def html(name=None):
 
 	message = 'Choose the database:'
-	directory = path + '\\Database\\GeoInfo'
-	archive = load(directory, 'pickle', message)
+	if name is None:
+		name = database('\\History', message)
 	
-	db = launch(archive[0])
-	
-	web = '\\Markers\\Generated' + '\\{}.html'.format(archive[1])
+	render(records('\\History', name), name)
+		
+	print('File succefully generated!')
 
-	for i, item in enumerate(db):
-	
-		source = path + '\\Markers\\source.html' if i == 0 else path + web
-		 
-		f =  open(source, 'r', encoding='utf-8')
-		data = f.readlines()
-		f.close()
-	
-		pattern = r'var locations'
+def htmlFromGeoInfo(name=None):
 
-		index = [data.index(x) for x in data if re.search(pattern, x)]
-		
-		info = ['    ', item, ',\n']
-		
-		new = data[:index[0]+1] + info + data[index[0]+1:]
-		
-		markers = open(path + web, 'w', encoding='utf-8')
-		
-		for x in new:
-			markers.write(str(x))
-		markers.close()
+	message = 'Choose the database:'
+	if name is None:
+		name = database('\\GeoInfo', message)
+	
+	render(records('\\GeoInfo', name), name)
 		
 	print('File succefully generated!')
 
+## -------------------- tiled markers --------------------
+
+# The page that shows the tiles written by tiles(), loading only the 
+# ones in view at the current zoom
+template = string.Template('''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>html, body, #map { height: 100%; margin: 0; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var deepest = $deepest;
+var requested = {};
+var markers = {};
+var map, info;
+
+function start() {
+	map = new google.maps.Map(document.getElementById('map'), {
+		center: $center,
+		zoom: 11
+	});
+	info = new google.maps.InfoWindow();
+	map.addListener('idle', show);
+}
+
+function level() {
+	return Math.min(map.getZoom(), deepest);
+}
+
+function show() {
+	var zoom = level();
+	var scale = Math.pow(2, zoom);
+	var bounds = map.getBounds();
+	var ne = bounds.getNorthEast(), sw = bounds.getSouthWest();
+
+	for (var z in markers) {
+		markers[z].forEach(function (marker) {
+			marker.setMap(Number(z) === zoom ? map : null);
+		});
+	}
+
+	var left = Math.floor((sw.lng() + 180) / 360 * scale);
+	var right = Math.floor((ne.lng() + 180) / 360 * scale);
+	var top = row(ne.lat(), scale), bottom = row(sw.lat(), scale);
+
+	if (right < left) {
+		right += scale;
+	}
+
+	for (var x = left; x <= right; x++) {
+		for (var y = Math.max(top, 0); y <= Math.min(bottom, scale - 1); y++) {
+			request(zoom, ((x % scale) + scale) % scale, y);
+		}
+	}
+}
+
+function row(lat, scale) {
+	var sin = Math.sin(lat * Math.PI / 180);
+	var y = 0.5 - Math.log((1 + sin) / (1 - sin)) / (4 * Math.PI);
+	return Math.floor(y * scale);
+}
+
+function request(zoom, x, y) {
+	var key = zoom + '/' + x + '/' + y;
+
+	if (requested[key]) {
+		return;
+	}
+	requested[key] = true;
+
+	// Tiles without any marker were never written
+	var script = document.createElement('script');
+	script.src = key + '.js';
+	script.onerror = script.onload = function () {
+		script.remove();
+	};
+	document.body.appendChild(script);
+}
+
+function tile(collection) {
+	var zoom = collection.zoom;
+	markers[zoom] = markers[zoom] || [];
+
+	collection.features.forEach(function (feature) {
+		var point = feature.geometry.coordinates;
+		var properties = feature.properties;
+
+		var marker = new google.maps.Marker({
+			position: {lat: point[1], lng: point[0]},
+			label: properties.count > 1 ? String(properties.count) : null,
+			map: level() === zoom ? map : null
+		});
+
+		marker.addListener('click', function () {
+			if (properties.count > 1) {
+				map.setCenter(marker.getPosition());
+				map.setZoom(zoom + 2);
+				return;
+			}
+
+			var content = document.createElement('div');
+			content.style.whiteSpace = 'pre-line';
+			content.textContent = properties.record.slice(0, -2).join('\\n');
+			info.setContent(content);
+			info.open(map, marker);
+		});
+
+		markers[zoom].push(marker);
+	});
+}
+</script>
+<script src="$script" async defer></script>
+</body>
+</html>
+''')
+
+
+def maps():
+	'''Return the address of the Google Maps script of the source page.
+
+	The page of tiles() loads the same script, with the same key, as the 
+	pages of render(), only calling start() once it's loaded.
+	'''
+
+	source = path + '\\Markers\\source.html'
+
+	with open(source, 'r', encoding='utf-8') as f:
+		page = f.read()
+
+	pattern = r'src=["\']([^"\']*maps\.googleapis\.com/maps/api/js[^"\']*)'
+	found = re.search(pattern, page)
+
+	if found is None:
+		raise ValueError('The source page has no Google Maps script.')
+
+	# Replace the callback of the source page, if it has one
+	script = re.sub(r'(&amp;|&)?callback=[^&]*', '', found.group(1))
+	script = re.sub(r'\?(&amp;|&)', '?', script)
+
+	if script.endswith('?'):
+		return script + 'callback=start'
+
+	return script + ('&' if '?' in script else '?') + 'callback=start'
+
+
+def tiles(db, name, deepest=16, cells=4):
+	'''Write the markers of a database as clustered tiles, and their page.
+
+	The positions are projected as in Google Maps and, at every zoom 
+	level above the deepest one, the points of each tile are grouped in 
+	a grid of cells by cells. Each group becomes a single marker with 
+	the number of points and their mean position. At the deepest level 
+	every point is a marker of its own, with its record.
+
+	Every tile is a GeoJSON FeatureCollection written to its own file, 
+	as <zoom>\\<x>\\<y>.js, wrapped in a call to tile(). That way the 
+	page only loads the tiles in view, with a script tag, which works 
+	even when the page is opened straight from the disk.
+
+	Args:
+		db: an iterable with the records of a GeoInfo database.
+		name: the name of the folder, inside Markers\\Generated, where 
+			the page and the tiles are written. The tiles of an earlier 
+			run in it are removed first.
+		deepest: the zoom level where the points are no longer grouped.
+		cells: the number of groups along each side of a tile.
+
+	Returns:
+		The path of the generated page.
+	'''
+
+	# Without a name the tiles would be mixed with the other pages
+	if not name.strip('\\/. '):
+		raise ValueError('The tiles need a folder name.')
+
+	script = maps()
+
+	points = []
+
+	for item in db:
+
+		# Bad addresses don't have a position
+		try:
+			lat, lng = float(item[-2]), float(item[-1])
+		except (TypeError, ValueError, IndexError):
+			continue
+
+		# Web mercator, as a fraction of the whole world
+		sin = math.sin(math.radians(max(min(lat, 85.0511), -85.0511)))
+		x = (lng + 180) / 360
+		y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+
+		points.append((min(x, 1 - 1e-12), min(y, 1 - 1e-12), lat, lng, item))
+
+	directory = path + '\\Markers\\Generated\\' + name
+
+	# The tiles of an earlier run may have points that are gone now, 
+	# but only the zoom folders are removed
+	if os.path.isdir(directory):
+		for item in os.listdir(directory):
+			if item.isdigit():
+				shutil.rmtree(
+					r'{}\{}'.format(directory, item),
+					ignore_errors=True
+				)
+
+	def feature(lat, lng, properties):
+		return {
+			'type': 'Feature',
+			'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+			'properties': properties
+		}
+
+	for zoom in range(deepest + 1):
+
+		scale = 2 ** zoom
+		features = collections.defaultdict(list)
+
+		if zoom == deepest:
+			for x, y, lat, lng, item in points:
+				features[int(x * scale), int(y * scale)].append(
+					feature(lat, lng, {'count': 1, 'record': item})
+				)
+
+		else:
+			groups = {}
+
+			for x, y, lat, lng, item in points:
+				key = int(x * scale * cells), int(y * scale * cells)
+				if key in groups:
+					group = groups[key]
+					group[0] += 1
+					group[1] += lat
+					group[2] += lng
+				else:
+					groups[key] = [1, lat, lng, item]
+
+			for (x, y), (count, lat, lng, item) in groups.items():
+				properties = {'count': count}
+				if count == 1:
+					properties['record'] = item
+				features[x // cells, y // cells].append(
+					feature(lat / count, lng / count, properties)
+				)
+
+		for (x, y), collection in features.items():
+
+			folder = r'{}\{}\{}'.format(directory, zoom, x)
+			os.makedirs(folder, exist_ok=True)
+
+			with open(r'{}\{}.js'.format(folder, y), 'w', encoding='utf-8') as f:
+				f.write('tile({});'.format(json.dumps({
+					'type': 'FeatureCollection',
+					'zoom': zoom,
+					'features': collection
+				}, ensure_ascii=False)))
+
+	if points:
+		center = {
+			'lat': sum(x[2] for x in points) / len(points),
+			'lng': sum(x[3] for x in points) / len(points)
+		}
+	else:
+		center = {'lat': 0, 'lng': 0}
+
+	web = directory + '\\index.html'
+
+	os.makedirs(directory, exist_ok=True)
+
+	with open(web, 'w', encoding='utf-8') as f:
+		f.write(template.substitute(
+			title=name,
+			deepest=deepest,
+			center=json.dumps(center),
+			script=script
+		))
+
+	return web
+
+
+def htmlTiles(name=None):
+
+	message = 'Choose the database:'
+	if name is None:
+		name = database('\\GeoInfo', message)
+
+	web = tiles(records('\\GeoInfo', name), name)
+
+	print('File succefully generated! Saved at: {}'.format(web))
+
 
 def main():
 	'''Manage all the process.'''
@@ -884,18 +3465,134 @@ def main():
 		html,
 		'Generate markers in Google Maps',
 		htmlFromGeoInfo,
-		'Generate markers without history'		
+		'Generate markers without history',
+		lambda: crawler(batch=True),
+		'Find ZIP Code and Geodata without asking (batch)',
+		resolve,
+		'Apply the choices of a review file',
+		lambda: crawler(resume=True),
+		'Resume an interrupted search',
+		migrate,
+		'Copy the old pickle databases to the storage',
+		replay,
+		'Parse the archived Google responses again',
+		lambda: crawler(offline=True),
+		'Find ZIP Code and Geodata with the archived responses only',
+		sort,
+		'Split a database by distribution center',
+		lambda: crawler(batch=True, folder=input(
+			'Type a folder or pattern inside Mailling, or nothing for all: '
+		)),
+		'Find ZIP Code and Geodata of many maillings at once (batch)',
+		htmlTiles,
+		'Generate clustered markers for large databases'
 	]
-	print('\nChoose an action to perform:')
+	# Ask for actions until the user stops the script
+	while True:
+
+		print('\nChoose an action to perform:')
+
+		option(functions[1::2])
+
+		action = input()
+		functions[::2][int(action)]()
+
 
-	option(functions[1::2])
+def cli(arguments=None):
+	'''Run a single action given in the command line.
 
-	action = input()
-	launch = functions[::2][int(action)]()
+	Every value the menu would ask for is given as an argument instead, 
+	so the script can run unattended. Only the modules needed by the 
+	chosen action are loaded. Run with --help to see every command.
 
-	main()
+	Args:
+		arguments: the list of arguments, or None for sys.argv.
+	'''
+
+	import argparse
+
+	global path
+
+	parser = argparse.ArgumentParser(
+		description='Find, bind and show the addresses of maillings.'
+	)
+	parser.add_argument('--path', default=path,
+		help='the folder with the Spreadsheets, Database and Logs folders')
+
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	command = commands.add_parser('crawl',
+		help='find the zip code and geodata of a mailling')
+	command.add_argument('mailling', nargs='?',
+		help='the path of the mailling, asked for if not given')
+	command.add_argument('--columns', type=int, nargs=7, metavar='INDEX',
+		help='the column of the receiver, addresse, address, number, '
+			'complement, city and zip code, or -1 if missing')
+	command.add_argument('--folder',
+		help='read every mailling in this folder or pattern inside '
+			'Spreadsheets\\Mailling instead of a single one')
+	command.add_argument('--workers', type=int, default=workers)
+	command.add_argument('--batch', action='store_true',
+		help='leave the ambiguous rows to a review file')
+	command.add_argument('--resume', action='store_true',
+		help='skip the rows finished by an interrupted run')
+	command.add_argument('--offline', action='store_true',
+		help='use only the archived Google responses')
+
+	command = commands.add_parser('match',
+		help='bind the labels to the addresses of a GeoInfo database')
+	command.add_argument('database')
+	command.add_argument('labels', help='the path of the labels spreadsheet')
+
+	command = commands.add_parser('events',
+		help='bind the latest delivery status to a Labels database')
+	command.add_argument('database')
+	command.add_argument('history', nargs='+',
+		help='the paths of the history spreadsheets, the latest last')
+
+	command = commands.add_parser('html',
+		help='generate the markers page of a database')
+	command.add_argument('database')
+	command.add_argument('--geoinfo', action='store_true',
+		help='use the GeoInfo database instead of the History one')
+	command.add_argument('--tiles', action='store_true',
+		help='write clustered tiles of the GeoInfo database')
+
+	command = commands.add_parser('sort',
+		help='split a GeoInfo database by distribution center')
+	command.add_argument('database')
+
+	options = parser.parse_args(arguments)
+	path = options.path
+
+	if options.command == 'crawl':
+		crawler(
+			workers=options.workers,
+			batch=options.batch or options.folder is not None,
+			resume=options.resume,
+			offline=options.offline,
+			folder=options.folder,
+			positions=options.columns,
+			mailling=options.mailling
+		)
+	elif options.command == 'match':
+		match(options.database, options.labels)
+	elif options.command == 'events':
+		events(options.database, options.history)
+	elif options.command == 'html' and options.tiles:
+		htmlTiles(options.database)
+	elif options.command == 'html' and options.geoinfo:
+		htmlFromGeoInfo(options.database)
+	elif options.command == 'html':
+		html(options.database)
+	elif options.command == 'sort':
+		sort(options.database)
 
 
 if __name__ == '__main__':
 
-	main()
\ No newline at end of file
+	# Without arguments, the menu is shown as before
+	if len(sys.argv) > 1:
+		cli()
+	else:
+		main()
\ No newline at end of file